@@ -2,6 +2,41 @@
 """Script to add /testapi command to telegram_bot.py"""
 
 import re
+from collections import namedtuple
+
+# Anchors that genuinely need a regex (multi-line / variable content)
+IMPORT_RE = re.compile(r"(try:\s+from manual_payment import get_manual_payment_handler.*?print\(\"⚠️ Manual Payment not available\"\))", re.DOTALL)
+HEALTH_RE = re.compile(r"(<p><strong>Payments:</strong> \{.*?\}</p>)")
+
+# Fixed-string anchors - plain str.replace is enough
+FUNC_LOC_MARKER = 'async def start(update: Update'
+HELP_HANDLER = 'application.add_handler(CommandHandler("help", help_command))'
+USER_HELP_LINE = '• `/help` - Get help & support'
+ADMIN_BACKEND_LINE = '• `/backend` - AI status'
+
+# A single change against the original buffer: replace content[start:end] with new_text
+Edit = namedtuple('Edit', ['start', 'end', 'new_text'])
+
+def insert_after(content, anchor, addition):
+    """Edit that inserts addition right after the first occurrence of anchor"""
+    pos = content.find(anchor)
+    if pos == -1:
+        return None
+    pos += len(anchor)
+    return Edit(pos, pos, addition)
+
+def apply_edits(content, edits):
+    """Materialize all edits in one pass with a single join"""
+    edits = sorted(e for e in edits if e is not None)
+    parts = []
+    i = 0
+    for e in edits:
+        assert e.start >= i, "overlapping edits"
+        parts.append(content[i:e.start])
+        parts.append(e.new_text)
+        i = e.end
+    parts.append(content[i:])
+    return ''.join(parts)
 
 def add_testapi_feature():
     # Read the current file
@@ -14,7 +49,6 @@ def add_testapi_feature():
         return
     
     # 1. Add api_key_tester import after manual_payment import
-    import_pattern = r"(try:\s+from manual_payment import get_manual_payment_handler.*?print\(\"⚠️ Manual Payment not available\"\))"
     import_addition = """\n\ntry:
     from api_key_tester import get_api_key_tester
     api_tester = get_api_key_tester()
@@ -24,15 +58,18 @@ except ImportError:
     api_tester = None
     print("⚠️ API Key Tester not available")"""
     
-    content = re.sub(import_pattern, r"\1" + import_addition, content, flags=re.DOTALL)
+    # All edits are computed against the original content and applied once at the end
+    edits = []
+    for m in IMPORT_RE.finditer(content):
+        edits.append(Edit(m.end(), m.end(), import_addition))
     
     # 2. Update health check HTML to show tester status
-    health_pattern = r"(<p><strong>Payments:</strong> \{.*?\}</p>)"
-    health_addition = r"\1\n            <p><strong>API Tester:</strong> {'✅ Enabled' if api_tester else '❌ Disabled'}</p>"
-    content = re.sub(health_pattern, health_addition, content)
+    health_addition = "\n            <p><strong>API Tester:</strong> {'✅ Enabled' if api_tester else '❌ Disabled'}</p>"
+    for m in HEALTH_RE.finditer(content):
+        edits.append(Edit(m.end(), m.end(), health_addition))
     
     # 3. Add test_api_key_command function after get_ai_backend_info function
-    function_location = content.find('async def start(update: Update')
+    function_location = content.find(FUNC_LOC_MARKER)
     
     testapi_function = '''\n# ============= API KEY TESTER COMMAND =============
 
@@ -88,27 +125,26 @@ async def test_api_key_command(update: Update, context: ContextTypes.DEFAULT_TYP
 
 '''
     
-    content = content[:function_location] + testapi_function + '\n' + content[function_location:]
+    if function_location != -1:
+        edits.append(Edit(function_location, function_location, testapi_function + '\n'))
     
     # 4. Add command handler in main() function
-    handler_pattern = r"(application\.add_handler\(CommandHandler\(\"help\", help_command\)\))"
-    handler_addition = r"\1\n    application.add_handler(CommandHandler(\"testapi\", test_api_key_command))"
-    content = re.sub(handler_pattern, handler_addition, content)
+    edits.append(insert_after(
+        content,
+        HELP_HANDLER,
+        '\n    application.add_handler(CommandHandler("testapi", test_api_key_command))'
+    ))
     
     # 5. Update /start welcome message to include /testapi
     # For users
-    user_commands_pattern = r"(• `/help` - Get help & support)"
-    user_commands_addition = r"\1\n• `/testapi <key>` - Test your API key"
-    content = re.sub(user_commands_pattern, user_commands_addition, content)
+    edits.append(insert_after(content, USER_HELP_LINE, '\n• `/testapi <key>` - Test your API key'))
     
     # For admin
-    admin_system_pattern = r"(• `/backend` - AI status)"
-    admin_system_addition = r"\1\n• `/testapi <key>` - Test any API key"
-    content = re.sub(admin_system_pattern, admin_system_addition, content)
+    edits.append(insert_after(content, ADMIN_BACKEND_LINE, '\n• `/testapi <key>` - Test any API key'))
     
     # Write back
     with open('telegram_bot.py', 'w', encoding='utf-8') as f:
-        f.write(content)
+        f.write(apply_edits(content, edits))
     
     print("✅ Successfully added /testapi feature to telegram_bot.py!")
     print("\nChanges made:")
@@ -6,16 +6,73 @@ Uses Multiple Free AI APIs for Premium Experience
 import os
 import json
 import time
+import logging
 import asyncio
+import hashlib
 import aiohttp
+import httpx
+import orjson
 from datetime import datetime
 from typing import Optional, Dict, List, Any
-from flask import Flask, request, jsonify, Response, stream_with_context
+from quart import Quart, request, jsonify, Response
+from orjson_provider import OrjsonProvider
+from single_flight import single_flight
 import google.generativeai as genai
-from groq import Groq
+from groq import AsyncGroq
 import random
+import re
+from collections import OrderedDict
+
+# Optional shared conversation store
+try:
+    import redis.asyncio as aioredis
+    REDIS_AVAILABLE = True
+except ImportError:
+    REDIS_AVAILABLE = False
+
+logger = logging.getLogger(__name__)
+WORD_RE = re.compile(r'[a-z]+')
+
+# Server-sent event framing
+SSE_PREFIX = b"data: "
+SSE_SUFFIX = b"\n\n"
+
+# Second-resolution ISO timestamp, re-formatted at most once per second
+_timestamp_cache = [0, '']
+
+def _timestamp() -> str:
+    now = int(time.time())
+    if now != _timestamp_cache[0]:
+        _timestamp_cache[0] = now
+        _timestamp_cache[1] = datetime.fromtimestamp(now).isoformat()
+    return _timestamp_cache[1]
+
 
 class AdvancedAIBackend:
+    # Keyword families used for model routing
+    CODE_KW = frozenset({'code', 'python', 'javascript', 'function', 'class', 'api', 'debug'})
+    CREATIVE_KW = frozenset({'story', 'poem', 'creative', 'imagine', 'design'})
+    
+    # keyword -> family, so one scan over the question reports every family hit
+    KEYWORD_FAMILY = {
+        **{kw: 'code' for kw in CODE_KW},
+        **{kw: 'creative' for kw in CREATIVE_KW}
+    }
+    
+    # Native names for the language instruction
+    LANG_MAP = {
+        'hindi': 'हिंदी',
+        'spanish': 'Español',
+        'french': 'Français',
+        'german': 'Deutsch',
+        'chinese': '中文',
+        'japanese': '日本語',
+        'arabic': 'العربية'
+    }
+    LANG_INSTRUCTION = {
+        lang: f"\n\nIMPORTANT: Respond in {name} language." for lang, name in LANG_MAP.items()
+    }
+    
     def __init__(self):
         """Initialize multiple AI providers for redundancy and features"""
         
@@ -24,13 +81,28 @@ class AdvancedAIBackend:
         if gemini_key:
             genai.configure(api_key=gemini_key)
         
-        # Configure Groq (Free, Ultra Fast) - FIX: Remove self._client parameter
+        # Configure Groq (Free, Ultra Fast) - async client over one shared
+        # keep-alive HTTP/2 connection pool, so calls reuse TCP/TLS connections
         groq_key = os.getenv('GROQ_API_KEY', '')
         if groq_key:
-            self.groq_client = Groq(api_key=groq_key)  # Fixed: removed invalid parameter
+            self.groq_client = AsyncGroq(
+                api_key=groq_key,
+                http_client=httpx.AsyncClient(
+                    http2=True,
+                    limits=httpx.Limits(max_connections=100, max_keepalive_connections=20, keepalive_expiry=60),
+                    timeout=httpx.Timeout(60.0, connect=10.0)
+                )
+            )
         else:
             self.groq_client = None
         
+        # In-flight upstream calls keyed by request hash (single-flight)
+        self._inflight = {}
+        
+        # Gemini model objects keyed by (temperature, max_tokens)
+        self._gemini_models = {}
+        self.max_gemini_models = 32
+        
         # Configure HuggingFace (Free)
         self.hf_api_key = os.getenv('HUGGINGFACE_API_KEY', '')
         
@@ -62,9 +134,17 @@ class AdvancedAIBackend:
             }
         }
         
-        # Conversation memory (in-memory, use Redis in production)
-        self.conversations = {}
+        # Conversation memory - Redis when REDIS_URL is set (shared across workers),
+        # otherwise in-memory
+        redis_url = os.getenv('REDIS_URL', '')
+        if REDIS_AVAILABLE and redis_url:
+            self.redis = aioredis.from_url(redis_url, decode_responses=True)
+        else:
+            self.redis = None
+        self.conversations = OrderedDict()  # LRU order, least recent user first
         self.max_history = 20  # Keep last 20 messages
+        self.max_users = 10_000  # Evict least recent users beyond this
+        self.conversation_ttl = 86400  # Redis history expires after 1 day idle
         
         # System prompts for different modes
         self.system_prompts = {
@@ -95,7 +175,7 @@ class AdvancedAIBackend:
             # Get conversation history if context enabled
             history = []
             if include_context and user_id:
-                history = self.conversations.get(user_id, [])
+                history = await self._get_history(user_id)
             
             # Select best model based on request
             model = self._select_best_model(question, tone)
@@ -115,29 +195,35 @@ class AdvancedAIBackend:
                 
                 # Save to conversation history
                 if include_context and user_id:
-                    self._update_conversation(user_id, question, response_data['response'])
+                    await self._update_conversation(user_id, question, response_data['response'])
                 
                 return response_data
                 
         except Exception as e:
-            print(f"Error in get_response: {e}")
+            logger.exception("Error in get_response")
             return await self._fallback_response(question, language)
     
     def _select_best_model(self, question: str, tone: str) -> str:
         """Select best model based on query characteristics"""
         
+        # For long context, use Gemini (1M tokens) - checked first so long
+        # questions are never lowercased or scanned
+        if len(question) > 2000:
+            return 'gemini'
+        
+        # Single pass over the lowercased words, collecting matched families
+        families = set()
+        for word in WORD_RE.findall(question.lower()):
+            family = self.KEYWORD_FAMILY.get(word)
+            if family:
+                families.add(family)
+        
         # For code-related queries, prefer Groq (faster)
-        code_keywords = ['code', 'python', 'javascript', 'function', 'class', 'api', 'debug']
-        if any(kw in question.lower() for kw in code_keywords) and self.groq_client:
+        if 'code' in families and self.groq_client:
             return 'groq'
         
         # For creative tasks, use Gemini
-        creative_keywords = ['story', 'poem', 'creative', 'imagine', 'design']
-        if any(kw in question.lower() for kw in creative_keywords) or tone == 'creative':
-            return 'gemini'
-        
-        # For long context, use Gemini (1M tokens)
-        if len(question) > 2000:
+        if 'creative' in families or tone == 'creative':
             return 'gemini'
         
         # Default: Use Gemini (best quality)
@@ -146,36 +232,45 @@ class AdvancedAIBackend:
     def _build_enhanced_prompt(self, question: str, tone: str, language: str, history: List) -> str:
         """Build enhanced prompt with system instructions"""
         
-        system_prompt = self.system_prompts.get(tone, self.system_prompts['default'])
+        parts = [self.system_prompts.get(tone, self.system_prompts['default'])]
         
         # Add language instruction
-        if language.lower() != 'english':
-            lang_map = {
-                'hindi': 'हिंदी',
-                'spanish': 'Español',
-                'french': 'Français',
-                'german': 'Deutsch',
-                'chinese': '中文',
-                'japanese': '日本語',
-                'arabic': 'العربية'
-            }
-            lang_name = lang_map.get(language.lower(), language)
-            system_prompt += f"\n\nIMPORTANT: Respond in {lang_name} language."
+        lang = language.lower()
+        if lang != 'english':
+            instruction = self.LANG_INSTRUCTION.get(lang)
+            if instruction is None:
+                instruction = f"\n\nIMPORTANT: Respond in {language} language."
+            parts.append(instruction)
         
         # Build full prompt with context
         if history:
-            context_text = "\n\nPrevious conversation:\n"
-            for msg in history[-6:]:  # Last 3 exchanges
-                context_text += f"User: {msg['user']}\nAssistant: {msg['assistant']}\n"
-            full_prompt = f"{system_prompt}\n{context_text}\n\nUser: {question}\nAssistant:"
-        else:
-            full_prompt = f"{system_prompt}\n\nUser: {question}\nAssistant:"
+            parts.append("\n\n\nPrevious conversation:\n")
+            parts.extend(
+                f"User: {msg['user']}\nAssistant: {msg['assistant']}\n"
+                for msg in history[-6:]  # Last 3 exchanges
+            )
         
-        return full_prompt
+        parts.append(f"\n\nUser: {question}\nAssistant:")
+        return ''.join(parts)
     
     async def _get_model_response(self, model_name: str, prompt: str, 
                                    temperature: float, max_tokens: int) -> Dict[str, Any]:
-        """Get response from specific model"""
+        """Get response from specific model, sharing one upstream call between identical concurrent requests"""
+        
+        key = hashlib.blake2b(
+            f"{model_name}|{prompt}|{temperature}|{max_tokens}".encode('utf-8'),
+            digest_size=16
+        ).hexdigest()
+        
+        # Callers add their own fields to the result, so hand out a copy
+        return dict(await single_flight(
+            self._inflight, key,
+            lambda: self._fetch_model_response(model_name, prompt, temperature, max_tokens)
+        ))
+    
+    async def _fetch_model_response(self, model_name: str, prompt: str, 
+                                    temperature: float, max_tokens: int) -> Dict[str, Any]:
+        """Call the upstream model"""
         
         start_time = time.time()
         
@@ -194,31 +289,43 @@ class AdvancedAIBackend:
                 'response': response,
                 'model': model_name,
                 'latency': round(latency, 2),
-                'tokens': len(response.split()),  # Approximate
-                'timestamp': datetime.now().isoformat()
+                'tokens': len(response) // 4,  # Approximate (~4 chars per token)
+                'timestamp': _timestamp()
             }
             
         except Exception as e:
-            print(f"Error with {model_name}: {e}")
+            logger.warning("Error with %s: %s", model_name, e)
             # Try fallback
             if model_name != 'gemini':
                 return await self._get_model_response('gemini', prompt, temperature, max_tokens)
             raise
     
+    def _get_gemini_model(self, temperature: float, max_tokens: int):
+        """Get cached Gemini model for this generation config"""
+        
+        key = (temperature, max_tokens)
+        model = self._gemini_models.get(key)
+        if model is None:
+            model = genai.GenerativeModel(
+                model_name='gemini-2.0-flash-exp',
+                generation_config={
+                    'temperature': temperature,
+                    'max_output_tokens': max_tokens,
+                    'top_p': 0.95,
+                    'top_k': 40
+                }
+            )
+            # Drop the oldest entry if clients send many distinct configs
+            if len(self._gemini_models) >= self.max_gemini_models:
+                del self._gemini_models[next(iter(self._gemini_models))]
+            self._gemini_models[key] = model
+        return model
+    
     async def _gemini_response(self, prompt: str, temperature: float, max_tokens: int) -> str:
         """Get response from Gemini (Google)"""
         
-        model = genai.GenerativeModel(
-            model_name='gemini-2.0-flash-exp',
-            generation_config={
-                'temperature': temperature,
-                'max_output_tokens': max_tokens,
-                'top_p': 0.95,
-                'top_k': 40
-            }
-        )
-        
-        response = await asyncio.to_thread(model.generate_content, prompt)
+        model = self._get_gemini_model(temperature, max_tokens)
+        response = await model.generate_content_async(prompt)
         return response.text
     
     async def _groq_response(self, model_name: str, prompt: str, 
@@ -234,8 +341,7 @@ class AdvancedAIBackend:
             'mixtral': 'mixtral-8x7b-32768'
         }
         
-        response = await asyncio.to_thread(
-            self.groq_client.chat.completions.create,
+        response = await self.groq_client.chat.completions.create(
             model=model_map.get(model_name, 'llama-3.3-70b-versatile'),
             messages=[{"role": "user", "content": prompt}],
             temperature=temperature,
@@ -245,39 +351,57 @@ class AdvancedAIBackend:
         
         return response.choices[0].message.content
     
+    async def _stream_chunks(self, model_name: str, prompt: str,
+                             temperature: float, max_tokens: int):
+        """Yield raw text chunks from the selected model"""
+        
+        if model_name == 'gemini':
+            model = self._get_gemini_model(temperature, max_tokens)
+            response = await model.generate_content_async(prompt, stream=True)
+            
+            async for chunk in response:
+                if chunk.text:
+                    yield chunk.text
+        
+        elif model_name in ['groq', 'mixtral'] and self.groq_client:
+            model_map = {
+                'groq': 'llama-3.3-70b-versatile',
+                'mixtral': 'mixtral-8x7b-32768'
+            }
+            
+            stream = await self.groq_client.chat.completions.create(
+                model=model_map[model_name],
+                messages=[{"role": "user", "content": prompt}],
+                temperature=temperature,
+                max_tokens=max_tokens,
+                stream=True
+            )
+            
+            async for chunk in stream:
+                if chunk.choices[0].delta.content:
+                    yield chunk.choices[0].delta.content
+    
     async def _stream_response(self, model_name: str, prompt: str,
                                temperature: float, max_tokens: int):
-        """Stream response for real-time output"""
+        """Stream response for real-time output (SSE frames)"""
         
         try:
-            if model_name == 'gemini':
-                model = genai.GenerativeModel('gemini-2.0-flash-exp')
-                response = model.generate_content(prompt, stream=True)
-                
-                for chunk in response:
-                    if chunk.text:
-                        yield f"data: {json.dumps({'text': chunk.text})}\n\n"
-            
-            elif model_name in ['groq', 'mixtral'] and self.groq_client:
-                model_map = {
-                    'groq': 'llama-3.3-70b-versatile',
-                    'mixtral': 'mixtral-8x7b-32768'
-                }
-                
-                stream = self.groq_client.chat.completions.create(
-                    model=model_map[model_name],
-                    messages=[{"role": "user", "content": prompt}],
-                    temperature=temperature,
-                    max_tokens=max_tokens,
-                    stream=True
-                )
-                
-                for chunk in stream:
-                    if chunk.choices[0].delta.content:
-                        yield f"data: {json.dumps({'text': chunk.choices[0].delta.content})}\n\n"
+            async for text in self._stream_chunks(model_name, prompt, temperature, max_tokens):
+                yield SSE_PREFIX + orjson.dumps({'text': text}) + SSE_SUFFIX
         
         except Exception as e:
-            yield f"data: {json.dumps({'error': str(e)})}\n\n"
+            yield SSE_PREFIX + orjson.dumps({'error': str(e)}) + SSE_SUFFIX
+    
+    async def _raw_stream_response(self, model_name: str, prompt: str,
+                                   temperature: float, max_tokens: int):
+        """Stream response as plain UTF-8 text, without JSON/SSE framing"""
+        
+        try:
+            async for text in self._stream_chunks(model_name, prompt, temperature, max_tokens):
+                yield text.encode('utf-8')
+        
+        except Exception as e:
+            yield f"\n[error] {e}\n".encode('utf-8')
     
     async def _fallback_response(self, question: str, language: str) -> Dict[str, Any]:
         """Fallback response if all models fail"""
@@ -291,28 +415,64 @@ class AdvancedAIBackend:
             'success': False,
             'response': fallback_text.get(language, fallback_text['english']),
             'error': 'All models unavailable',
-            'timestamp': datetime.now().isoformat(),
+            'timestamp': _timestamp(),
             'fallback_needed': True
         }
     
-    def _update_conversation(self, user_id: str, user_msg: str, assistant_msg: str):
+    async def close(self):
+        """Close pooled connections"""
+        if self.groq_client:
+            await self.groq_client.close()
+        if self.redis:
+            await self.redis.close()
+    
+    async def _get_history(self, user_id: str, limit: int = 6) -> List:
+        """Get the most recent conversation turns, oldest first"""
+        
+        if self.redis:
+            # Newest turns sit at the head of the list
+            raw = await self.redis.lrange(f"conv:{user_id}", 0, limit - 1)
+            return [json.loads(item) for item in reversed(raw)]
+        
+        history = self.conversations.get(user_id)
+        if history is None:
+            return []
+        self.conversations.move_to_end(user_id)
+        return history[-limit:]
+    
+    async def _update_conversation(self, user_id: str, user_msg: str, assistant_msg: str):
         """Update conversation history"""
         
+        if self.redis:
+            key = f"conv:{user_id}"
+            async with self.redis.pipeline(transaction=False) as pipe:
+                pipe.lpush(key, json.dumps({'user': user_msg, 'assistant': assistant_msg}))
+                pipe.ltrim(key, 0, self.max_history - 1)
+                pipe.expire(key, self.conversation_ttl)
+                await pipe.execute()
+            return
+        
         if user_id not in self.conversations:
             self.conversations[user_id] = []
         
         self.conversations[user_id].append({
             'user': user_msg,
-            'assistant': assistant_msg,
-            'timestamp': datetime.now().isoformat()
+            'assistant': assistant_msg
         })
         
         # Keep only recent messages
         if len(self.conversations[user_id]) > self.max_history:
             self.conversations[user_id] = self.conversations[user_id][-self.max_history:]
+        
+        # Bound memory across users
+        self.conversations.move_to_end(user_id)
+        while len(self.conversations) > self.max_users:
+            self.conversations.popitem(last=False)
     
-    def clear_conversation(self, user_id: str):
+    async def clear_conversation(self, user_id: str):
         """Clear conversation history for user"""
+        if self.redis:
+            await self.redis.delete(f"conv:{user_id}")
         if user_id in self.conversations:
             del self.conversations[user_id]
     
@@ -327,7 +487,7 @@ class AdvancedAIBackend:
             return {
                 'success': True,
                 'analysis': response,
-                'timestamp': datetime.now().isoformat()
+                'timestamp': _timestamp()
             }
             
         except Exception as e:
@@ -349,14 +509,16 @@ class AdvancedAIBackend:
         
         try:
             summary = await self._gemini_response(prompt, 0.3, 2048)
+            original_length = len(content)
+            summary_length = len(summary)
             
             return {
                 'success': True,
                 'summary': summary,
                 'style': style,
-                'original_length': len(content),
-                'summary_length': len(summary),
-                'compression_ratio': round(len(summary) / len(content), 2)
+                'original_length': original_length,
+                'summary_length': summary_length,
+                'compression_ratio': round(summary_length / original_length, 2) if original_length else 0.0
             }
             
         except Exception as e:
@@ -397,24 +559,43 @@ class AdvancedAIBackend:
             }
 
 
-# Flask App
-app = Flask(__name__)
+# Quart App (ASGI) - all requests share one event loop
+# Run: gunicorn -c gunicorn_conf.py advanced_ai_backend:app
+app = Quart(__name__)
+app.json = OrjsonProvider(app)
 ai_backend = AdvancedAIBackend()
 
+@app.after_serving
+async def shutdown():
+    await ai_backend.close()
+
+# Static info responses, encoded once at startup
+# Cache-Control lets a proxy/CDN in front answer these without reaching Python
+HOME_CACHE_CONTROL = {'Cache-Control': 'public, max-age=300'}
+HEALTH_CACHE_CONTROL = {'Cache-Control': 'public, max-age=10'}
+
+HOME_JSON = orjson.dumps({
+    'name': 'Advanced AI API',
+    'version': '2.0',
+    'status': 'active',
+    'models': ['Gemini 2.0 Flash', 'Groq Llama 3.3', 'Mixtral 8x7B'],
+    'features': ['Multi-language', 'Conversation context', 'Code assistance', 'Streaming', '100% FREE']
+})
+
+HEALTH_JSON = orjson.dumps({
+    'status': 'healthy',
+    'models': ['gemini', 'groq', 'mixtral'],
+    'version': '2.0'
+})
+
 @app.route('/', methods=['GET'])
-def home():
-    return jsonify({
-        'name': 'Advanced AI API',
-        'version': '2.0',
-        'status': 'active',
-        'models': ['Gemini 2.0 Flash', 'Groq Llama 3.3', 'Mixtral 8x7B'],
-        'features': ['Multi-language', 'Conversation context', 'Code assistance', 'Streaming', '100% FREE']
-    })
+async def home():
+    return Response(HOME_JSON, mimetype='application/json', headers=HOME_CACHE_CONTROL)
 
 @app.route('/chat', methods=['POST'])
 async def chat():
     try:
-        data = request.json
+        data = await request.get_json(silent=True) or {}
         question = data.get('question', '')
         if not question:
             return jsonify({'success': False, 'error': 'Question required'}), 400
@@ -436,27 +617,32 @@ async def chat():
 @app.route('/stream', methods=['POST'])
 async def stream_chat():
     try:
-        data = request.json
+        data = await request.get_json(silent=True) or {}
         question = data.get('question', '')
         if not question:
             return jsonify({'error': 'Question required'}), 400
         
-        model = ai_backend._select_best_model(question, data.get('tone', 'default'))
+        tone = data.get('tone', 'default')
+        temperature = data.get('temperature', 0.7)
+        max_tokens = data.get('max_tokens', 4096)
+        
+        model = ai_backend._select_best_model(question, tone)
         prompt = ai_backend._build_enhanced_prompt(
             question, 
-            data.get('tone', 'default'), 
+            tone, 
             data.get('language', 'english'), 
             []
         )
         
+        # Plain-text clients (curl, terminals) get raw tokens without SSE framing
+        if request.accept_mimetypes.best == 'text/plain':
+            return Response(
+                ai_backend._raw_stream_response(model, prompt, temperature, max_tokens),
+                mimetype='text/plain'
+            )
+        
         return Response(
-            stream_with_context(
-                ai_backend._stream_response(
-                    model, prompt, 
-                    data.get('temperature', 0.7), 
-                    data.get('max_tokens', 4096)
-                )
-            ),
+            ai_backend._stream_response(model, prompt, temperature, max_tokens),
             mimetype='text/event-stream'
         )
     except Exception as e:
@@ -465,7 +651,8 @@ async def stream_chat():
 @app.route('/analyze', methods=['POST'])
 async def analyze():
     try:
-        text = request.json.get('text', '')
+        data = await request.get_json(silent=True) or {}
+        text = data.get('text', '')
         if not text:
             return jsonify({'error': 'Text required'}), 400
         result = await ai_backend.analyze_text(text)
@@ -476,12 +663,13 @@ async def analyze():
 @app.route('/summarize', methods=['POST'])
 async def summarize():
     try:
-        content = request.json.get('content', '')
+        data = await request.get_json(silent=True) or {}
+        content = data.get('content', '')
         if not content:
             return jsonify({'error': 'Content required'}), 400
         result = await ai_backend.summarize_content(
             content, 
-            request.json.get('style', 'concise')
+            data.get('style', 'concise')
         )
         return jsonify(result)
     except Exception as e:
@@ -490,33 +678,32 @@ async def summarize():
 @app.route('/code', methods=['POST'])
 async def code_assist():
     try:
+        data = await request.get_json(silent=True) or {}
         result = await ai_backend.code_assistance(
-            request.json.get('code'),
-            request.json.get('task'),
-            request.json.get('language', 'python')
+            data.get('code'),
+            data.get('task'),
+            data.get('language', 'python')
         )
         return jsonify(result)
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
 @app.route('/clear', methods=['POST'])
-def clear_history():
+async def clear_history():
     try:
-        user_id = request.json.get('user_id')
+        data = await request.get_json(silent=True) or {}
+        user_id = data.get('user_id')
         if not user_id:
             return jsonify({'error': 'user_id required'}), 400
-        ai_backend.clear_conversation(user_id)
+        await ai_backend.clear_conversation(user_id)
         return jsonify({'success': True, 'message': 'Conversation cleared'})
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
 @app.route('/health', methods=['GET'])
-def health():
-    return jsonify({
-        'status': 'healthy',
-        'models': ['gemini', 'groq', 'mixtral'],
-        'version': '2.0'
-    })
+async def health():
+    return Response(HEALTH_JSON, mimetype='application/json', headers=HEALTH_CACHE_CONTROL)
 
 if __name__ == '__main__':
-    app.run(debug=False, host='0.0.0.0', port=5000)
+    import uvicorn
+    uvicorn.run(app, host='0.0.0.0', port=int(os.getenv('PORT', 5000)))
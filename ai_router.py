@@ -4,22 +4,75 @@ Automatically routes to best available AI backend with fallback
 """
 
 import os
+import re
+import copy
+import time
+import queue
+import atexit
+import logging
+import logging.handlers
+import hashlib
 import asyncio
+import functools
+import threading
+import importlib
+import importlib.util
+import httpx
 from typing import Dict, Any, Optional
 from datetime import datetime
+from collections import OrderedDict
+from config import Config
+from single_flight import single_flight
 
-# Import all available backends
-try:
-    from perplexity_backend import get_perplexity_backend
-    PERPLEXITY_AVAILABLE = True
-except ImportError:
-    PERPLEXITY_AVAILABLE = False
+logger = logging.getLogger(__name__)
 
-try:
-    from advanced_ai_backend import AdvancedAIBackend
-    ADVANCED_AI_AVAILABLE = True
-except ImportError:
-    ADVANCED_AI_AVAILABLE = False
+
+class _RootForwarder(logging.Handler):
+    """Hand records to the root logger's handlers"""
+    
+    def emit(self, record):
+        logging.getLogger().callHandlers(record)
+
+
+# Router logs go through a queue - the listener thread does the actual
+# stream I/O, so a fallback storm never blocks the event loop on stdout
+_log_queue = queue.SimpleQueue()
+logger.addHandler(logging.handlers.QueueHandler(_log_queue))
+logger.propagate = False
+_log_listener = logging.handlers.QueueListener(_log_queue, _RootForwarder())
+_log_listener.start()
+atexit.register(_log_listener.stop)
+
+# Upstream statuses meaning the backend's own key is bad - later requests
+# would fail the same way, so the backend is skipped for AUTH_RETRY_AFTER
+# seconds (long enough to stop hammering it, short enough that a rotated
+# key or a transient upstream 403 recovers without a restart)
+AUTH_FAILURE_STATUSES = (401, 403)
+AUTH_RETRY_AFTER = 300
+
+# Questions that need live results - anything else is answered without
+# the slower online-search models
+SEARCH_HINT_RE = re.compile(
+    r"\b(latest|today|tonight|yesterday|news|current(?:ly)?|now|recent(?:ly)?|"
+    r"this (?:week|month|year)|20[2-9][0-9]|price of|score|weather)\b",
+    re.IGNORECASE
+)
+
+# Tunable per-call parameters each backend takes, with their defaults.
+# Bound once into the backend's dispatcher; callers' kwargs override them.
+BACKEND_PARAMS = {
+    'perplexity': {'model': 'sonar', 'temperature': 0.7, 'max_tokens': 2048},
+    'advanced_ai': {'temperature': 0.7, 'max_tokens': 4096, 'stream': False},
+}
+
+# Online-search answers go stale quickly - keep them this long (seconds)
+SEARCH_CACHE_TTL = 300
+
+# Backends are imported lazily on first use - their SDK imports
+# (google-generativeai, groq, ...) are slow and unused backends never pay for them.
+# Here we only check that the modules exist.
+PERPLEXITY_AVAILABLE = importlib.util.find_spec('perplexity_backend') is not None
+ADVANCED_AI_AVAILABLE = importlib.util.find_spec('advanced_ai_backend') is not None
 
 
 class AIRouter:
@@ -30,49 +83,95 @@ class AIRouter:
     - Auto fallback on errors
     """
     
+    __slots__ = (
+        'backends', '_dispatchers', 'backend_priority', 'default_backend', '_failed',
+        'hedge_delay', '_response_cache', '_search_cache', 'cache_size', '_inflight',
+        '_auth_retry_at'
+    )
+    
     def __init__(self):
-        """Initialize all available backends"""
-        self.backends = {}
-        self.backend_priority = []
-        
-        # Initialize Perplexity
-        if PERPLEXITY_AVAILABLE:
-            try:
-                perplexity = get_perplexity_backend()
-                if perplexity.is_available():
-                    self.backends['perplexity'] = perplexity
-                    self.backend_priority.append('perplexity')
-                    print("✅ Perplexity backend initialized")
-            except Exception as e:
-                print(f"⚠️ Perplexity init failed: {e}")
-        
-        # Initialize Advanced AI
+        """Record configured backends - instances are created on first use"""
+        self.backends = {}  # Initialized backend instances
+        self._dispatchers = {}  # backend.get_response with default params bound
+        self.backend_priority = ()  # Configured backends, in priority order (rebuilt on change)
+        self._failed = set()  # Backends whose import/init failed
+        self._auth_retry_at = {}  # Backend -> monotonic time its credentials may be retried
+        
+        # Start one extra backend if the first is slower than this (seconds, None = never)
+        self.hedge_delay = Config.AI_HEDGE_DELAY or None
+        
+        # L1 exact-match response cache (LRU)
+        self._response_cache = OrderedDict()
+        # Online-search responses: key -> (expires_at, result), LRU + TTL
+        self._search_cache = OrderedDict()
+        
+        # Upstream calls in flight by cache key - concurrent identical
+        # requests share one call (single-flight)
+        self._inflight = {}
+        self.cache_size = 1024
+        
+        priority = []
+        
+        # Perplexity (only if a key is configured)
+        if PERPLEXITY_AVAILABLE and Config.is_perplexity_enabled():
+            priority.append('perplexity')
+        
+        # Advanced AI
         if ADVANCED_AI_AVAILABLE:
-            try:
-                self.backends['advanced_ai'] = AdvancedAIBackend()
-                self.backend_priority.append('advanced_ai')
-                print("✅ Advanced AI backend initialized")
-            except Exception as e:
-                print(f"⚠️ Advanced AI init failed: {e}")
+            priority.append('advanced_ai')
+        
+        self.backend_priority = tuple(priority)
         
         # Set default backend
         self.default_backend = self.backend_priority[0] if self.backend_priority else None
         
         if not self.default_backend:
-            print("❌ No AI backends available!")
+            logger.error("❌ No AI backends available!")
+    
+    def _ensure_backend(self, backend_name: str):
+        """Import and create backend on first use, memoizing failures"""
+        
+        backend = self.backends.get(backend_name)
+        if backend is not None or backend_name in self._failed:
+            return backend
+        
+        try:
+            if backend_name == 'perplexity':
+                module = importlib.import_module('perplexity_backend')
+                backend = module.get_perplexity_backend()
+                if not backend.is_available():
+                    backend = None
+            elif backend_name == 'advanced_ai':
+                module = importlib.import_module('advanced_ai_backend')
+                backend = module.AdvancedAIBackend()
+        except Exception as e:
+            logger.warning("⚠️ %s init failed: %s", backend_name, e)
+            backend = None
+        
+        if backend is None:
+            self._failed.add(backend_name)
+            self.disable_backend(backend_name)
+            return None
+        
+        self.backends[backend_name] = backend
+        self._dispatchers[backend_name] = functools.partial(
+            backend.get_response, **BACKEND_PARAMS[backend_name]
+        )
+        logger.info("✅ %s backend initialized", backend_name)
+        return backend
     
     def is_available(self) -> bool:
         """Check if any backend is available"""
-        return bool(self.backends)
+        return bool(self.backend_priority)
     
     def get_backend_status(self) -> Dict[str, Any]:
         """Get status of all backends"""
         return {
-            'available_backends': list(self.backends.keys()),
-            'priority_order': self.backend_priority,
+            'available_backends': list(self.backend_priority),
+            'priority_order': list(self.backend_priority),
             'default': self.default_backend,
-            'perplexity_enabled': 'perplexity' in self.backends,
-            'advanced_ai_enabled': 'advanced_ai' in self.backends
+            'perplexity_enabled': 'perplexity' in self.backend_priority,
+            'advanced_ai_enabled': 'advanced_ai' in self.backend_priority
         }
     
     async def get_response(
@@ -110,53 +209,182 @@ class AIRouter:
                 'response': 'AI service is currently unavailable. Please try again later.'
             }
         
+        # Evergreen questions don't need online search
+        if search_online and not SEARCH_HINT_RE.search(question):
+            search_online = False
+        
+        # Exact-match cache - skipped for conversation context (depends on
+        # per-user history). Live search is cached briefly by normalized query.
+        cache_key = None
+        search_key = None
+        if search_online and not include_context:
+            search_key = self._cache_key(self._normalize(question), language, tone, prefer_backend, kwargs)
+            cached = self._search_cache_get(search_key)
+            if cached is not None:
+                return cached
+        elif not include_context:
+            cache_key = self._cache_key(question, language, tone, prefer_backend, kwargs)
+            cached = self._response_cache.get(cache_key)
+            if cached is not None:
+                self._response_cache.move_to_end(cache_key)
+                result = copy.deepcopy(cached)
+                result['cache'] = 'HIT-L1'
+                return result
+        
+        flight_key = cache_key or (search_key and 'search:' + search_key)
+        if flight_key is None:
+            return await self._route(question, user_id, language, tone, prefer_backend,
+                                     search_online, include_context, **kwargs)
+        
+        # Identical requests already on their way upstream share one call
+        async def fetch():
+            result = await self._route(question, user_id, language, tone, prefer_backend,
+                                       search_online, include_context, **kwargs)
+            if result['success']:
+                if cache_key:
+                    self._cache_store(cache_key, result)
+                else:
+                    self._search_cache_store(search_key, result)
+            return result
+        
+        # Every caller gets its own copy of the shared result
+        return copy.deepcopy(await single_flight(self._inflight, flight_key, fetch))
+    
+    async def _route(
+        self,
+        question: str,
+        user_id: str,
+        language: str,
+        tone: str,
+        prefer_backend: str,
+        search_online: bool,
+        include_context: bool,
+        **kwargs
+    ) -> Dict[str, Any]:
+        """Run the request against the backends, hedging between them"""
+        
         # Determine backend order
-        if prefer_backend and prefer_backend in self.backends:
+        if prefer_backend and prefer_backend in self.backend_priority:
             # Try preferred backend first
-            backend_order = [prefer_backend] + [b for b in self.backend_priority if b != prefer_backend]
+            backend_order = (prefer_backend,) + tuple(b for b in self.backend_priority if b != prefer_backend)
         else:
             # Use default priority
-            backend_order = self.backend_priority.copy()
+            backend_order = self.backend_priority
         
         # If online search requested, prioritize Perplexity
-        if search_online and 'perplexity' in self.backends:
-            backend_order = ['perplexity'] + [b for b in backend_order if b != 'perplexity']
-        
-        # Try each backend in order
-        for backend_name in backend_order:
-            try:
-                result = await self._try_backend(
-                    backend_name,
-                    question,
-                    user_id,
-                    language,
-                    tone,
-                    search_online,
-                    include_context,
-                    **kwargs
+        if search_online and 'perplexity' in self.backend_priority:
+            backend_order = ('perplexity',) + tuple(b for b in backend_order if b != 'perplexity')
+        
+        # Try backends in order, falling back on failure. With hedging on,
+        # if the first backend hasn't answered within hedge_delay, the next
+        # one is started too (once - never the whole list) and whichever
+        # succeeds first wins.
+        pending = {}
+        remaining = iter(backend_order)
+        hedge_delay = self.hedge_delay
+        
+        def launch_next() -> bool:
+            backend_name = next(remaining, None)
+            if backend_name is None:
+                return False
+            task = asyncio.create_task(self._try_backend(
+                backend_name,
+                question,
+                user_id,
+                language,
+                tone,
+                search_online,
+                include_context,
+                **kwargs
+            ))
+            pending[task] = backend_name
+            return True
+        
+        launch_next()
+        try:
+            while pending:
+                done, _ = await asyncio.wait(
+                    pending, timeout=hedge_delay, return_when=asyncio.FIRST_COMPLETED
                 )
                 
-                if result['success']:
-                    result['backend_used'] = backend_name
-                    return result
-                
-                # If backend returned fallback_needed, try next
-                if result.get('fallback_needed'):
-                    print(f"⚠️ {backend_name} failed, trying fallback...")
+                if not done:
+                    hedge_delay = None
+                    launch_next()
                     continue
                 
-            except Exception as e:
-                print(f"❌ Error with {backend_name}: {e}")
-                continue
+                for task in done:
+                    backend_name = pending.pop(task)
+                    try:
+                        result = task.result()
+                    except Exception as e:
+                        logger.error("❌ Error with %s: %s", backend_name, e)
+                        continue
+                    
+                    if result['success']:
+                        result['backend_used'] = backend_name
+                        return result
+                    
+                    # Backend says the request itself is bad - don't retry it elsewhere
+                    if result.get('fallback_needed') is False:
+                        result['backend_used'] = backend_name
+                        return result
+                    
+                    logger.warning("⚠️ %s failed, trying fallback...", backend_name)
+                
+                if not pending:
+                    launch_next()
+        finally:
+            # Cancel the losers
+            for task in pending:
+                task.cancel()
         
         # All backends failed
         return {
             'success': False,
             'error': 'All AI backends failed',
             'response': 'I apologize, but I\'m unable to process your request right now. Please try again in a moment.',
-            'backends_tried': backend_order
+            'backends_tried': list(backend_order)
         }
     
+    @staticmethod
+    def _cache_key(question: str, language: str, tone: str, prefer_backend: str, params: Dict) -> str:
+        """Hash of everything that shapes the response"""
+        raw = repr((question, language, tone, prefer_backend, sorted(params.items())))
+        return hashlib.blake2b(raw.encode('utf-8'), digest_size=16).hexdigest()
+    
+    @staticmethod
+    def _normalize(query: str) -> str:
+        """Case- and whitespace-insensitive form of a search query"""
+        return ' '.join(query.lower().split())
+    
+    def _search_cache_get(self, search_key: str) -> Optional[Dict[str, Any]]:
+        """Fresh cached search result, or None"""
+        entry = self._search_cache.get(search_key)
+        if entry is None:
+            return None
+        expires_at, cached = entry
+        if expires_at < time.monotonic():
+            del self._search_cache[search_key]
+            return None
+        self._search_cache.move_to_end(search_key)
+        result = copy.deepcopy(cached)
+        result['cache'] = 'HIT-SEARCH'
+        return result
+    
+    def _search_cache_store(self, search_key: str, result: Dict[str, Any]):
+        """Store a successful search result for SEARCH_CACHE_TTL seconds"""
+        self._search_cache[search_key] = (time.monotonic() + SEARCH_CACHE_TTL, copy.deepcopy(result))
+        self._search_cache.move_to_end(search_key)
+        while len(self._search_cache) > self.cache_size:
+            self._search_cache.popitem(last=False)
+    
+    def _cache_store(self, cache_key: str, result: Dict[str, Any]):
+        """Store a successful response, evicting the least recently used"""
+        self._response_cache[cache_key] = copy.deepcopy(result)
+        self._response_cache.move_to_end(cache_key)
+        while len(self._response_cache) > self.cache_size:
+            self._response_cache.popitem(last=False)
+    
     async def _try_backend(
         self,
         backend_name: str,
@@ -170,93 +398,160 @@ class AIRouter:
     ) -> Dict[str, Any]:
         """Try specific backend"""
         
-        backend = self.backends[backend_name]
+        retry_at = self._auth_retry_at.get(backend_name)
+        if retry_at is not None:
+            if time.monotonic() < retry_at:
+                return {'success': False, 'error': f'{backend_name} credentials rejected', 'fallback_needed': True}
+            del self._auth_retry_at[backend_name]
+        
+        backend = self._ensure_backend(backend_name)
+        if backend is None:
+            return {'success': False, 'error': f'{backend_name} unavailable', 'fallback_needed': True}
+        
+        # Any other exception (often a parsing/SDK bug in this backend)
+        # goes up to _route, which falls back to the next backend
+        try:
+            result = await self._call_backend(backend_name, question, user_id,
+                                              language, tone, search_online, include_context,
+                                              **kwargs)
+        except (asyncio.TimeoutError, ConnectionError, httpx.TransportError) as e:
+            # Transient (timeouts, refused/reset connections - builtin or
+            # from httpx, which the backends' clients use) - the next
+            # backend may well answer
+            return {'success': False, 'error': f'{backend_name} unreachable: {e}', 'fallback_needed': True}
+        
+        if result.get('status') in AUTH_FAILURE_STATUSES:
+            logger.error("❌ %s rejected our credentials, skipping it for %ds", backend_name, AUTH_RETRY_AFTER)
+            self._auth_retry_at[backend_name] = time.monotonic() + AUTH_RETRY_AFTER
+        
+        return result
+    
+    async def _call_backend(
+        self,
+        backend_name: str,
+        question: str,
+        user_id: str,
+        language: str,
+        tone: str,
+        search_online: bool,
+        include_context: bool,
+        **kwargs
+    ) -> Dict[str, Any]:
+        """Dispatch the request to a backend's own API"""
+        
+        dispatch = self._dispatchers.get(backend_name)
+        if dispatch is None:
+            return {'success': False, 'error': f'Unknown backend: {backend_name}'}
+        
+        # Only parameters the caller actually set - the rest are pre-bound
+        overrides = {k: kwargs[k] for k in kwargs.keys() & BACKEND_PARAMS[backend_name]} if kwargs else {}
+        overrides.pop('stream', None)
         
         if backend_name == 'perplexity':
             # Perplexity API call
-            return await backend.get_response(
+            return await dispatch(
                 question=question,
                 user_id=user_id,
-                model=kwargs.get('model', 'sonar'),
-                temperature=kwargs.get('temperature', 0.7),
-                max_tokens=kwargs.get('max_tokens', 2048),
                 include_context=include_context,
                 search_online=search_online,
-                tone=tone
-            )
-        
-        elif backend_name == 'advanced_ai':
-            # Advanced AI (Gemini/Groq) call
-            return await backend.get_response(
-                question=question,
-                user_id=user_id,
-                language=language,
                 tone=tone,
-                include_context=include_context,
-                max_tokens=kwargs.get('max_tokens', 4096),
-                temperature=kwargs.get('temperature', 0.7),
-                stream=False
+                **overrides
             )
         
-        return {'success': False, 'error': f'Unknown backend: {backend_name}'}
+        # Advanced AI (Gemini/Groq) call
+        return await dispatch(
+            question=question,
+            user_id=user_id,
+            language=language,
+            tone=tone,
+            include_context=include_context,
+            **overrides
+        )
     
     async def search(self, query: str) -> Dict[str, Any]:
         """Quick search - uses Perplexity if available, else Advanced AI"""
         
-        if 'perplexity' in self.backends:
-            return await self.backends['perplexity'].search(query)
-        elif 'advanced_ai' in self.backends:
-            return await self.backends['advanced_ai'].get_response(
-                question=f"Search and provide information about: {query}",
-                temperature=0.3
-            )
+        search_key = self._cache_key(self._normalize(query), 'search', None, None, {})
+        cached = self._search_cache_get(search_key)
+        if cached is not None:
+            return cached
         
-        return {'success': False, 'error': 'No search backend available'}
+        result = None
+        perplexity = self._ensure_backend('perplexity') if 'perplexity' in self.backend_priority else None
+        if perplexity:
+            result = await perplexity.search(query)
+        else:
+            advanced_ai = self._ensure_backend('advanced_ai') if 'advanced_ai' in self.backend_priority else None
+            if advanced_ai:
+                result = await advanced_ai.get_response(
+                    question=f"Search and provide information about: {query}",
+                    temperature=0.3
+                )
+        
+        if result is None:
+            return {'success': False, 'error': 'No search backend available'}
+        
+        if result.get('success'):
+            self._search_cache_store(search_key, result)
+        return result
     
     def enable_backend(self, backend_name: str) -> bool:
         """Enable specific backend"""
         if backend_name == 'perplexity' and PERPLEXITY_AVAILABLE:
-            try:
-                perplexity = get_perplexity_backend()
-                if perplexity.is_available():
-                    self.backends['perplexity'] = perplexity
-                    if 'perplexity' not in self.backend_priority:
-                        self.backend_priority.insert(0, 'perplexity')
-                    return True
-            except:
-                pass
+            self._failed.discard('perplexity')
+            self._auth_retry_at.pop('perplexity', None)
+            if 'perplexity' not in self.backend_priority:
+                self.backend_priority = ('perplexity',) + self.backend_priority
+            if self._ensure_backend('perplexity'):
+                return True
         return False
     
     def disable_backend(self, backend_name: str) -> bool:
         """Disable specific backend"""
-        if backend_name in self.backends:
-            del self.backends[backend_name]
-            if backend_name in self.backend_priority:
-                self.backend_priority.remove(backend_name)
+        if backend_name in self.backend_priority:
+            self.backends.pop(backend_name, None)
+            self._dispatchers.pop(backend_name, None)
+            self.backend_priority = tuple(b for b in self.backend_priority if b != backend_name)
+            if self.default_backend == backend_name:
+                self.default_backend = self.backend_priority[0] if self.backend_priority else None
             return True
         return False
     
     def set_default_backend(self, backend_name: str) -> bool:
         """Set default backend"""
-        if backend_name in self.backends:
+        if backend_name in self.backend_priority:
             self.default_backend = backend_name
             # Move to front of priority
-            self.backend_priority = [backend_name] + [
+            self.backend_priority = (backend_name,) + tuple(
                 b for b in self.backend_priority if b != backend_name
-            ]
+            )
             return True
         return False
 
 
 # Singleton instance
 _ai_router = None
+_ai_router_lock = threading.Lock()
+_ai_router_async_lock = asyncio.Lock()
 
 def get_ai_router() -> AIRouter:
-    """Get or create AI router instance"""
+    """Get or create AI router instance (thread-safe)"""
     global _ai_router
     
     if _ai_router is None:
-        _ai_router = AIRouter()
+        with _ai_router_lock:
+            if _ai_router is None:
+                _ai_router = AIRouter()
+    
+    return _ai_router
+
+async def get_ai_router_async() -> AIRouter:
+    """Get or create AI router instance without blocking the event loop"""
+    
+    if _ai_router is None:
+        async with _ai_router_async_lock:
+            if _ai_router is None:
+                await asyncio.to_thread(get_ai_router)
     
     return _ai_router
 
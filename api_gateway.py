@@ -1,53 +1,260 @@
-from flask import Flask, request, jsonify
-import requests
+from quart import Quart, request, jsonify, Response, g
+from orjson_provider import OrjsonProvider
+from single_flight import single_flight
+import httpx
+import asyncio
 import json
+import orjson
 import os
-from database import Database
+from database import get_database
 from config import Config
 from datetime import datetime
+from urllib.parse import quote
 import base64
 import io
+from functools import wraps, partial
+from cachetools import TTLCache
+import time
 
-app = Flask(__name__)
-db = Database()
+# Optional shared rate-limit counters
+try:
+    import redis.asyncio as aioredis
+    REDIS_AVAILABLE = True
+except ImportError:
+    REDIS_AVAILABLE = False
+
+# Quart (ASGI) app - one event loop keeps many upstream calls in flight
+# Run: gunicorn -c gunicorn_conf.py api_gateway:app
+app = Quart(__name__)
+app.json = OrjsonProvider(app)
+db = get_database()
 
 # Premium AI Services Configuration
-CLAUDE_API_KEY = os.environ.get('CLAUDE_API_KEY') or os.getenv('CLAUDE_API_KEY', '')
-GEMINI_API_KEY = os.environ.get('GEMINI_API_KEY') or os.getenv('GEMINI_API_KEY', '')
-PERPLEXITY_API_KEY = os.environ.get('PERPLEXITY_API_KEY') or os.getenv('PERPLEXITY_API_KEY', '')
+CLAUDE_API_KEY = Config.CLAUDE_API_KEY
+GEMINI_API_KEY = Config.GEMINI_API_KEY
+PERPLEXITY_API_KEY = Config.PERPLEXITY_API_KEY
 
-def get_chatbot_response(question):
-    """Forward request to main chatbot API"""
-    english_instruction = "Please respond in English."
-    enhanced_question = f"{english_instruction} {question}"
+# Sent on every upstream call - set once on the client
+CLIENT_HEADERS = {
+    "Accept": "application/json",
+    "Content-Type": "application/json"
+}
+CHATBOT_HEADERS = {
+    "User-Agent": "Mozilla/5.0 (Linux; Android 10; K) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Mobile Safari/537.36"
+}
+CLAUDE_HEADERS = {
+    "x-api-key": CLAUDE_API_KEY,
+    "anthropic-version": "2023-06-01"
+}
+PERPLEXITY_HEADERS = {
+    "Authorization": f"Bearer {PERPLEXITY_API_KEY}"
+}
+RETRY_STATUSES = (502, 503, 504)
+CHATBOT_URL = "https://chatbot-ji1z.onrender.com/chatbot-ji1z"
+CHATBOT_HOST_URL = "https://chatbot-ji1z.onrender.com/"
+
+# Start the code fallback if Claude hasn't answered within this (seconds)
+CLAUDE_HEDGE_DELAY = 10
+
+# Render idles free dynos after 15 minutes - ping more often than that
+CHATBOT_KEEPALIVE_INTERVAL = 240
+
+# Fixed opening turn of every chatbot conversation
+ASSISTANT_GREETING = {"role": "assistant", "content": "Hello! How can I help you today?"}
+ENGLISH_INSTRUCTION = "Please respond in English. "
+
+# Pooled HTTP/2 client shared by all upstream calls - keep-alive connections
+# are reused instead of a new TCP+TLS handshake per call, and concurrent
+# requests to one host multiplex over a single connection. Created on startup
+# so it is bound to the serving event loop.
+_http = None
+_keepalive_task = None
+_usage_flush_task = None
+_redis = None
+
+async def keep_chatbot_warm():
+    """Open a pooled connection to the chatbot host now, then keep it (and the dyno) alive"""
+    while True:
+        try:
+            await _http.head(CHATBOT_HOST_URL, timeout=5)
+        except Exception:
+            pass
+        await asyncio.sleep(CHATBOT_KEEPALIVE_INTERVAL)
+
+@app.before_serving
+async def startup():
+    global _http, _keepalive_task, _usage_flush_task, _redis
+    await db.ensure_indexes()
+    if REDIS_AVAILABLE and Config.REDIS_URL:
+        _redis = aioredis.from_url(Config.REDIS_URL)
+    _http = httpx.AsyncClient(
+        headers=CLIENT_HEADERS,
+        # retries= re-attempts failed connects (not requests) before giving up
+        transport=httpx.AsyncHTTPTransport(
+            http2=True,
+            retries=2,
+            limits=httpx.Limits(max_connections=100, max_keepalive_connections=50)
+        )
+    )
+    # First /chat after boot shouldn't pay the TLS handshake (or a cold dyno)
+    _keepalive_task = asyncio.create_task(keep_chatbot_warm())
+    _usage_flush_task = asyncio.create_task(db.flush_usage_periodically())
+
+@app.after_serving
+async def shutdown():
+    if _keepalive_task:
+        _keepalive_task.cancel()
+    if _usage_flush_task:
+        _usage_flush_task.cancel()
+    await db.close()
+    if _http:
+        await _http.aclose()
+    if _redis:
+        await _redis.close()
+
+# Successful chatbot responses by question (only touched from the event loop)
+_chat_cache = TTLCache(maxsize=2048, ttl=3600)
+
+# Keys the DB rejected - absorbs repeated bad-key/brute-force traffic.
+# Kept short so a freshly bought key works within seconds.
+_bad_key_cache = TTLCache(maxsize=10_000, ttl=5)
+
+async def validate_api_key(api_key):
+    """db.validate_api_key (cached for valid keys) plus a negative cache
+    
+    Database errors propagate (callers answer 500) and aren't cached.
+    """
+    if api_key in _bad_key_cache:
+        return None
+    key_data = await db.validate_api_key(api_key)
+    if not key_data:
+        _bad_key_cache[api_key] = True
+    return key_data
+
+# Requests per key per minute window, by plan (Config.RATE_LIMITS).
+# Counted in Redis when REDIS_URL is set so all workers share one
+# budget, otherwise per worker in memory.
+RATE_WINDOW = 60
+_rate_counts = TTLCache(maxsize=100_000, ttl=RATE_WINDOW + 5)
+
+async def check_rate_limit(api_key, plan):
+    """Count this request; False once the key is over its plan's limit"""
+    limit = Config.RATE_LIMITS.get(plan, Config.RATE_LIMIT_FREE)
+    window_key = f"rl:{api_key}:{int(time.time() // RATE_WINDOW)}"
+    if _redis:
+        try:
+            # INCR + EXPIRE in one round trip
+            async with _redis.pipeline(transaction=False) as pipe:
+                pipe.incr(window_key)
+                pipe.expire(window_key, RATE_WINDOW + 5)
+                count, _ = await pipe.execute()
+            return count <= limit
+        except Exception:
+            # Redis down - don't turn every request away
+            return True
+    count = _rate_counts.get(window_key, 0) + 1
+    _rate_counts[window_key] = count
+    return count <= limit
+
+# Auth failures are the same bytes every time - encode them once
+KEY_REQUIRED_JSON = orjson.dumps({"success": False, "error": "API key required. Add 'X-API-Key' header."})
+KEY_INVALID_JSON = orjson.dumps({"success": False, "error": "Invalid or expired API key"})
+KEY_DISABLED_JSON = orjson.dumps({"success": False, "error": "API key is disabled. Contact support."})
+RATE_LIMITED_JSON = orjson.dumps({"success": False, "error": "Rate limit exceeded. Try again in a minute."})
+
+def require_api_key(view=None, *, active=True):
+    """Validate the X-API-Key header before the view runs.
     
+    The view finds the key in g.api_key and its document in g.key_data.
+    Pass active=False to also let disabled keys through; those views
+    aren't rate limited either.
+    """
+    if view is None:
+        return partial(require_api_key, active=active)
+    
+    @wraps(view)
+    async def wrapper(*args, **kwargs):
+        api_key = request.headers.get('X-API-Key')
+        if not api_key:
+            return Response(KEY_REQUIRED_JSON, status=401, mimetype='application/json')
+        
+        try:
+            key_data = await validate_api_key(api_key)
+        except Exception as e:
+            return jsonify({
+                "success": False,
+                "error": f"Server error: {str(e)}"
+            }), 500
+        
+        # validate_api_key also checks expiry
+        if not key_data:
+            return Response(KEY_INVALID_JSON, status=401, mimetype='application/json')
+        if active:
+            if not key_data['is_active']:
+                return Response(KEY_DISABLED_JSON, status=403, mimetype='application/json')
+            if not await check_rate_limit(api_key, key_data['plan']):
+                return Response(RATE_LIMITED_JSON, status=429, mimetype='application/json')
+        
+        g.api_key = api_key
+        g.key_data = key_data
+        return await view(*args, **kwargs)
+    
+    return wrapper
+
+# Response fields for a key without an expiry date
+NO_EXPIRY = {"expiry_date": None, "expires_in_days": None, "is_expired": False}
+
+def expiry_info(key_data, with_hours=False):
+    """Expiry fields for a key document"""
+    expiry = key_data.get('expiry_date')
+    if not expiry:
+        return dict(NO_EXPIRY)
+    
+    now = datetime.now()
+    remaining = expiry - now
+    info = {
+        "expiry_date": expiry.date().isoformat(),
+        "expires_in_days": max(0, remaining.days),
+        "is_expired": now > expiry
+    }
+    if with_hours:
+        info["expires_in_hours"] = max(0, remaining.seconds // 3600) if remaining.days == 0 else None
+    return info
+
+# Chatbot calls currently in flight by question - concurrent identical
+# questions share one upstream call
+_chat_inflight = {}
+
+async def get_chatbot_response(question):
+    """Forward request to main chatbot API"""
     payload = {
         "messages": [
-            {"role": "assistant", "content": "Hello! How can I help you today?"},
-            {"role": "user", "content": enhanced_question}
+            ASSISTANT_GREETING,
+            {"role": "user", "content": ENGLISH_INSTRUCTION + question}
         ]
     }
     
-    headers = {
-        "User-Agent": "Mozilla/5.0 (Linux; Android 10; K) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Mobile Safari/537.36",
-        "Accept": "application/json",
-        "Content-Type": "application/json"
-    }
-    
-    url = "https://chatbot-ji1z.onrender.com/chatbot-ji1z"
-    
     try:
-        response = requests.post(url, json=payload, headers=headers, timeout=30)
-        if response.status_code == 200:
-            api_response = response.json()
-            return {
-                "success": True,
-                "response": api_response['choices'][0]['message']['content']
-            }
-        else:
+        # Retry transient gateway errors from the free-tier host
+        for attempt in range(3):
+            # Streamed so that error pages are never downloaded - only a
+            # 200 body is read, once, straight into orjson
+            async with _http.stream("POST", CHATBOT_URL, json=payload, headers=CHATBOT_HEADERS,
+                                    timeout=30) as response:
+                status = response.status_code
+                body = await response.aread() if status == 200 else None
+            if status in RETRY_STATUSES and attempt < 2:
+                await asyncio.sleep(0.2 * 2 ** attempt)
+                continue
+            if body is not None:
+                api_response = orjson.loads(body)
+                return {
+                    "success": True,
+                    "response": api_response['choices'][0]['message']['content']
+                }
             return {
                 "success": False,
-                "error": f"API returned status code {response.status_code}"
+                "error": f"API returned status code {status}"
             }
     except Exception as e:
         return {
@@ -55,12 +262,49 @@ def get_chatbot_response(question):
             "error": f"Request failed: {str(e)}"
         }
 
+async def get_cached_chatbot_response(question):
+    """Chatbot response, served from cache for repeated questions"""
+    cached = _chat_cache.get(question)
+    if cached is not None:
+        result = dict(cached)
+        result['cache'] = 'HIT-L1'
+        return result
+    
+    async def fetch():
+        result = await get_chatbot_response(question)
+        if result['success']:
+            _chat_cache[question] = dict(result)
+        return result
+    
+    # Concurrent requests for the same question share one upstream call
+    return dict(await single_flight(_chat_inflight, question, fetch))
+
+# Pollinations URL templates - the prompt is the only variable part
+IMAGE_URL_TEMPLATE = "https://image.pollinations.ai/prompt/{}?width=1024&height=1024&nologo=true"
+VIDEO_URL_TEMPLATE = "https://image.pollinations.ai/prompt/{}?width=1024&height=576&model=video&duration={}"
+
+# Successful code expert answers by (language, question)
+_code_cache = TTLCache(maxsize=1024, ttl=600)
+
+async def get_cached_code_response(question, language):
+    """Code expert response, served from cache for repeated questions"""
+    key = (language, question)
+    cached = _code_cache.get(key)
+    if cached is not None:
+        result = dict(cached)
+        result['cache'] = 'HIT-L1'
+        return result
+    
+    result = await code_expert_claude(question, language)
+    if result['success']:
+        _code_cache[key] = dict(result)
+    return result
+
 def generate_image_pollinations(prompt):
     """Generate image using Pollinations AI (Free)"""
     try:
         # Pollinations.ai - Free high-quality image generation
-        encoded_prompt = requests.utils.quote(prompt)
-        image_url = f"https://image.pollinations.ai/prompt/{encoded_prompt}?width=1024&height=1024&nologo=true"
+        image_url = IMAGE_URL_TEMPLATE.format(quote(prompt, safe=""))
         
         return {
             "success": True,
@@ -80,8 +324,7 @@ def generate_video_pollinations(prompt, duration=3):
     """Generate video using Pollinations AI (Free)"""
     try:
         # Pollinations.ai video generation
-        encoded_prompt = requests.utils.quote(prompt)
-        video_url = f"https://image.pollinations.ai/prompt/{encoded_prompt}?width=1024&height=576&model=video&duration={duration}"
+        video_url = VIDEO_URL_TEMPLATE.format(quote(prompt, safe=""), duration)
         
         return {
             "success": True,
@@ -98,72 +341,90 @@ def generate_video_pollinations(prompt, duration=3):
             "error": str(e)
         }
 
-def code_expert_claude(question, language="python"):
-    """Code expert using Claude Sonnet 3.5 (if available)"""
-    try:
-        if not CLAUDE_API_KEY:
-            # Fallback to Perplexity for code assistance
-            if PERPLEXITY_API_KEY:
-                return code_expert_perplexity(question, language)
-            else:
-                return code_expert_fallback(question, language)
-        
-        headers = {
-            "x-api-key": CLAUDE_API_KEY,
-            "anthropic-version": "2023-06-01",
-            "content-type": "application/json"
-        }
-        
-        system_prompt = f"""You are an expert {language} programmer and code reviewer.
+# Fixed parts of every Claude code request - only the language and the
+# question vary
+CLAUDE_URL = "https://api.anthropic.com/v1/messages"
+CLAUDE_SYSTEM_PROMPT = """You are an expert {} programmer and code reviewer.
 Provide clean, efficient, and well-documented code.
 Explain your solutions clearly.
 Follow best practices and modern standards.
 Include error handling where appropriate."""
-        
+CLAUDE_PARAMS = {
+    "model": "claude-3-5-sonnet-20241022",
+    "max_tokens": 4096,
+    "temperature": 0.3
+}
+
+async def call_claude(question, language):
+    """One Claude request - result dict, or None on any failure"""
+    try:
         payload = {
-            "model": "claude-3-5-sonnet-20241022",
-            "max_tokens": 4096,
-            "temperature": 0.3,
-            "system": system_prompt,
+            **CLAUDE_PARAMS,
+            "system": CLAUDE_SYSTEM_PROMPT.format(language),
             "messages": [
                 {"role": "user", "content": question}
             ]
         }
         
-        response = requests.post(
-            "https://api.anthropic.com/v1/messages",
-            headers=headers,
+        async with _http.stream(
+            "POST",
+            CLAUDE_URL,
+            headers=CLAUDE_HEADERS,
             json=payload,
             timeout=60
-        )
+        ) as response:
+            if response.status_code != 200:
+                return None
+            result = orjson.loads(await response.aread())
         
-        if response.status_code == 200:
-            result = response.json()
-            code_response = result['content'][0]['text']
-            
-            return {
-                "success": True,
-                "response": code_response,
-                "model": "Claude 3.5 Sonnet",
-                "provider": "Anthropic",
-                "language": language,
-                "tokens_used": result.get('usage', {}).get('output_tokens', 0)
-            }
+        return {
+            "success": True,
+            "response": result['content'][0]['text'],
+            "model": "Claude 3.5 Sonnet",
+            "provider": "Anthropic",
+            "language": language,
+            "tokens_used": result.get('usage', {}).get('output_tokens', 0)
+        }
+    except Exception:
+        return None
+
+async def code_expert_claude(question, language="python"):
+    """Code expert using Claude Sonnet 3.5 (if available)"""
+    if not CLAUDE_API_KEY:
+        # Fallback to Perplexity for code assistance
+        if PERPLEXITY_API_KEY:
+            return await code_expert_perplexity(question, language)
         else:
-            # Fallback on error
-            return code_expert_fallback(question, language)
-            
-    except Exception as e:
-        return code_expert_fallback(question, language)
+            return await code_expert_fallback(question, language)
+    
+    claude = asyncio.create_task(call_claude(question, language))
+    done, _ = await asyncio.wait({claude}, timeout=CLAUDE_HEDGE_DELAY)
+    if done:
+        # Answered (or failed) quickly - no race needed
+        return claude.result() or await code_expert_fallback(question, language)
+    
+    # Claude is slow - start the fallback too and take whichever answers first
+    fallback = asyncio.create_task(code_expert_fallback(question, language))
+    pending = {claude, fallback}
+    fallback_result = None
+    try:
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                result = task.result()
+                if result and result['success']:
+                    return result
+                if task is fallback:
+                    fallback_result = result
+    finally:
+        for task in pending:
+            task.cancel()
+    
+    return fallback_result
 
-def code_expert_perplexity(question, language="python"):
+async def code_expert_perplexity(question, language="python"):
     """Code expert using Perplexity as fallback"""
     try:
-        headers = {
-            "Authorization": f"Bearer {PERPLEXITY_API_KEY}",
-            "Content-Type": "application/json"
-        }
-        
         payload = {
             "model": "llama-3.1-sonar-small-128k-online",
             "messages": [
@@ -177,15 +438,15 @@ def code_expert_perplexity(question, language="python"):
             "max_tokens": 2048
         }
         
-        response = requests.post(
+        response = await _http.post(
             "https://api.perplexity.ai/chat/completions",
-            headers=headers,
+            headers=PERPLEXITY_HEADERS,
             json=payload,
             timeout=30
         )
+        result = orjson.loads(response.content) if response.status_code == 200 else None
         
-        if response.status_code == 200:
-            result = response.json()
+        if result is not None:
             return {
                 "success": True,
                 "response": result['choices'][0]['message']['content'],
@@ -196,12 +457,12 @@ def code_expert_perplexity(question, language="python"):
     except:
         pass
     
-    return code_expert_fallback(question, language)
+    return await code_expert_fallback(question, language)
 
-def code_expert_fallback(question, language):
+async def code_expert_fallback(question, language):
     """Fallback code expert using main chatbot"""
     enhanced_question = f"As an expert {language} programmer, {question}. Provide clean, well-documented code with explanations."
-    result = get_chatbot_response(enhanced_question)
+    result = await get_chatbot_response(enhanced_question)
     
     if result['success']:
         result['model'] = "Gemini/Groq Fallback"
@@ -210,64 +471,50 @@ def code_expert_fallback(question, language):
     
     return result
 
+# API information never changes - encode it once. Cache-Control lets a
+# proxy/CDN in front answer these without reaching Python at all.
+HOME_CACHE_CONTROL = {'Cache-Control': 'public, max-age=300'}
+HEALTH_CACHE_CONTROL = {'Cache-Control': 'public, max-age=10'}
+
+HOME_RESPONSE_JSON = orjson.dumps({
+    "message": "API Seller Gateway - Premium AI Features",
+    "version": "3.0",
+    "status": "active",
+    "powered_by": "Claude 3.5 Sonnet + Pollinations AI",
+    "endpoints": {
+        "/": "GET - API information",
+        "/chat": "POST - Chat with AI (requires API key)",
+        "/image": "POST - Generate images (requires API key)",
+        "/video": "POST - Generate videos (requires API key)",
+        "/code": "POST - Code expert assistant (requires API key)",
+        "/validate": "POST - Validate API key",
+        "/usage": "GET - Check your API usage"
+    },
+    "features": [
+        "🤖 Claude 3.5 Sonnet AI Chat",
+        "🎨 AI Image Generation",
+        "🎬 AI Video Generation",
+        "💻 Code Expert Assistant",
+        "🔐 API Key Authentication",
+        "📊 Usage Tracking"
+    ],
+    "note": "API key required in header: X-API-Key"
+})
+
 @app.route('/', methods=['GET'])
-def home():
+async def home():
     """API Information"""
-    return jsonify({
-        "message": "API Seller Gateway - Premium AI Features",
-        "version": "3.0",
-        "status": "active",
-        "powered_by": "Claude 3.5 Sonnet + Pollinations AI",
-        "endpoints": {
-            "/": "GET - API information",
-            "/chat": "POST - Chat with AI (requires API key)",
-            "/image": "POST - Generate images (requires API key)",
-            "/video": "POST - Generate videos (requires API key)",
-            "/code": "POST - Code expert assistant (requires API key)",
-            "/validate": "POST - Validate API key",
-            "/usage": "GET - Check your API usage"
-        },
-        "features": [
-            "🤖 Claude 3.5 Sonnet AI Chat",
-            "🎨 AI Image Generation",
-            "🎬 AI Video Generation",
-            "💻 Code Expert Assistant",
-            "🔐 API Key Authentication",
-            "📊 Usage Tracking"
-        ],
-        "note": "API key required in header: X-API-Key"
-    })
+    return Response(HOME_RESPONSE_JSON, mimetype='application/json', headers=HOME_CACHE_CONTROL)
 
 @app.route('/chat', methods=['POST'])
-def chat():
+@require_api_key
+async def chat():
     """Main chat endpoint with API key validation"""
     try:
-        # Get API key from header
-        api_key = request.headers.get('X-API-Key')
-        
-        if not api_key:
-            return jsonify({
-                "success": False,
-                "error": "API key required. Add 'X-API-Key' header."
-            }), 401
-        
-        # Validate API key (also checks expiry)
-        key_data = db.validate_api_key(api_key)
-        if not key_data:
-            return jsonify({
-                "success": False,
-                "error": "Invalid or expired API key"
-            }), 401
-        
-        # Check if key is active
-        if not key_data['is_active']:
-            return jsonify({
-                "success": False,
-                "error": "API key is disabled. Contact support."
-            }), 403
+        api_key, key_data = g.api_key, g.key_data
         
         # Get question from request
-        data = request.get_json()
+        data = await request.get_json()
         if not data or 'question' not in data:
             return jsonify({
                 "success": False,
@@ -282,27 +529,23 @@ def chat():
             }), 400
         
         # Update usage count
-        db.increment_usage(api_key)
+        db.increment_usage(api_key, key_data)
         
         # Get chatbot response
-        result = get_chatbot_response(question)
+        result = await get_cached_chatbot_response(question)
         
         # Add usage info to response
         if result['success']:
             result['usage'] = {
-                "requests_used": key_data['requests_used'] + 1,
+                "requests_used": key_data['requests_used'],
                 "plan": key_data['plan']
             }
             
             # Add expiry info if exists
             if key_data.get('expiry_date'):
-                try:
-                    expiry = datetime.fromisoformat(key_data['expiry_date'])
-                    days_left = (expiry - datetime.now()).days
-                    result['usage']['expires_in_days'] = max(0, days_left)
-                    result['usage']['expiry_date'] = key_data['expiry_date'][:10]
-                except:
-                    pass
+                info = expiry_info(key_data)
+                result['usage']['expires_in_days'] = info['expires_in_days']
+                result['usage']['expiry_date'] = info['expiry_date']
         
         return jsonify(result), 200 if result['success'] else 500
             
@@ -313,26 +556,14 @@ def chat():
         }), 500
 
 @app.route('/image', methods=['POST'])
-def generate_image():
+@require_api_key
+async def generate_image():
     """Generate AI images"""
     try:
-        # Validate API key
-        api_key = request.headers.get('X-API-Key')
-        if not api_key:
-            return jsonify({
-                "success": False,
-                "error": "API key required"
-            }), 401
-        
-        key_data = db.validate_api_key(api_key)
-        if not key_data or not key_data['is_active']:
-            return jsonify({
-                "success": False,
-                "error": "Invalid or expired API key"
-            }), 401
+        api_key, key_data = g.api_key, g.key_data
         
         # Get prompt
-        data = request.get_json()
+        data = await request.get_json()
         if not data or 'prompt' not in data:
             return jsonify({
                 "success": False,
@@ -347,14 +578,14 @@ def generate_image():
             }), 400
         
         # Update usage
-        db.increment_usage(api_key)
+        db.increment_usage(api_key, key_data)
         
         # Generate image
         result = generate_image_pollinations(prompt)
         
         if result['success']:
             result['usage'] = {
-                "requests_used": key_data['requests_used'] + 1,
+                "requests_used": key_data['requests_used'],
                 "plan": key_data['plan']
             }
         
@@ -367,26 +598,14 @@ def generate_image():
         }), 500
 
 @app.route('/video', methods=['POST'])
-def generate_video():
+@require_api_key
+async def generate_video():
     """Generate AI videos"""
     try:
-        # Validate API key
-        api_key = request.headers.get('X-API-Key')
-        if not api_key:
-            return jsonify({
-                "success": False,
-                "error": "API key required"
-            }), 401
-        
-        key_data = db.validate_api_key(api_key)
-        if not key_data or not key_data['is_active']:
-            return jsonify({
-                "success": False,
-                "error": "Invalid or expired API key"
-            }), 401
+        api_key, key_data = g.api_key, g.key_data
         
         # Get prompt and duration
-        data = request.get_json()
+        data = await request.get_json()
         if not data or 'prompt' not in data:
             return jsonify({
                 "success": False,
@@ -407,14 +626,14 @@ def generate_video():
             duration = 3
         
         # Update usage
-        db.increment_usage(api_key)
+        db.increment_usage(api_key, key_data)
         
         # Generate video
         result = generate_video_pollinations(prompt, duration)
         
         if result['success']:
             result['usage'] = {
-                "requests_used": key_data['requests_used'] + 1,
+                "requests_used": key_data['requests_used'],
                 "plan": key_data['plan']
             }
         
@@ -427,26 +646,14 @@ def generate_video():
         }), 500
 
 @app.route('/code', methods=['POST'])
-def code_expert():
+@require_api_key
+async def code_expert():
     """Code expert assistant powered by Claude 3.5 Sonnet"""
     try:
-        # Validate API key
-        api_key = request.headers.get('X-API-Key')
-        if not api_key:
-            return jsonify({
-                "success": False,
-                "error": "API key required"
-            }), 401
-        
-        key_data = db.validate_api_key(api_key)
-        if not key_data or not key_data['is_active']:
-            return jsonify({
-                "success": False,
-                "error": "Invalid or expired API key"
-            }), 401
+        api_key, key_data = g.api_key, g.key_data
         
         # Get question and language
-        data = request.get_json()
+        data = await request.get_json()
         if not data or 'question' not in data:
             return jsonify({
                 "success": False,
@@ -463,14 +670,14 @@ def code_expert():
             }), 400
         
         # Update usage
-        db.increment_usage(api_key)
+        db.increment_usage(api_key, key_data)
         
         # Get code expert response
-        result = code_expert_claude(question, language)
+        result = await get_cached_code_response(question, language)
         
         if result['success']:
             result['usage'] = {
-                "requests_used": key_data['requests_used'] + 1,
+                "requests_used": key_data['requests_used'],
                 "plan": key_data['plan']
             }
         
@@ -482,12 +689,29 @@ def code_expert():
             "error": str(e)
         }), 500
 
+# Feature lists in /validate and /usage responses (never change)
+KEY_FEATURES = (
+    "AI Chat",
+    "Image Generation",
+    "Video Generation",
+    "Code Expert"
+)
+USAGE_FEATURES = (
+    "AI Chat (Claude 3.5 Sonnet)",
+    "Image Generation (Flux)",
+    "Video Generation (Mochi)",
+    "Code Expert (Claude)"
+)
+
 @app.route('/validate', methods=['POST'])
-def validate_key():
+async def validate_key():
     """Validate API key"""
     try:
-        data = request.get_json()
-        api_key = data.get('api_key') or request.headers.get('X-API-Key')
+        # Same header as @require_api_key; the body is only parsed as a fallback
+        api_key = request.headers.get('X-API-Key')
+        if not api_key:
+            data = await request.get_json(silent=True) or {}
+            api_key = data.get('api_key')
         
         if not api_key:
             return jsonify({
@@ -495,7 +719,7 @@ def validate_key():
                 "error": "API key required"
             }), 400
         
-        key_data = db.validate_api_key(api_key)
+        key_data = await validate_api_key(api_key)
         
         if key_data:
             response_data = {
@@ -505,28 +729,10 @@ def validate_key():
                 "requests_used": key_data['requests_used'],
                 "is_active": key_data['is_active'],
                 "created_at": key_data['created_at'],
-                "features": [
-                    "AI Chat",
-                    "Image Generation",
-                    "Video Generation",
-                    "Code Expert"
-                ]
+                "features": KEY_FEATURES
             }
             
-            # Add expiry info if exists
-            if key_data.get('expiry_date'):
-                try:
-                    expiry = datetime.fromisoformat(key_data['expiry_date'])
-                    days_left = (expiry - datetime.now()).days
-                    response_data['expiry_date'] = key_data['expiry_date'][:10]
-                    response_data['expires_in_days'] = max(0, days_left)
-                    response_data['is_expired'] = datetime.now() > expiry
-                except:
-                    pass
-            else:
-                response_data['expiry_date'] = None
-                response_data['expires_in_days'] = None
-                response_data['is_expired'] = False
+            response_data.update(expiry_info(key_data))
             
             return jsonify(response_data), 200
         else:
@@ -542,23 +748,11 @@ def validate_key():
         }), 500
 
 @app.route('/usage', methods=['GET'])
-def get_usage():
+@require_api_key(active=False)
+async def get_usage():
     """Get API usage statistics"""
     try:
-        api_key = request.headers.get('X-API-Key')
-        
-        if not api_key:
-            return jsonify({
-                "success": False,
-                "error": "API key required in header"
-            }), 401
-        
-        key_data = db.validate_api_key(api_key)
-        if not key_data:
-            return jsonify({
-                "success": False,
-                "error": "Invalid or expired API key"
-            }), 401
+        api_key, key_data = g.api_key, g.key_data
         
         response_data = {
             "success": True,
@@ -568,32 +762,11 @@ def get_usage():
             "is_active": key_data['is_active'],
             "created_at": key_data['created_at'],
             "api_key": api_key[:10] + "..." + api_key[-5:],  # Masked key
-            "available_features": [
-                "AI Chat (Claude 3.5 Sonnet)",
-                "Image Generation (Flux)",
-                "Video Generation (Mochi)",
-                "Code Expert (Claude)"
-            ]
+            "available_features": USAGE_FEATURES
         }
         
-        # Add expiry info if exists
-        if key_data.get('expiry_date'):
-            try:
-                expiry = datetime.fromisoformat(key_data['expiry_date'])
-                now = datetime.now()
-                days_left = (expiry - now).days
-                hours_left = (expiry - now).seconds // 3600
-                
-                response_data['expiry_date'] = key_data['expiry_date'][:10]
-                response_data['expires_in_days'] = max(0, days_left)
-                response_data['expires_in_hours'] = max(0, hours_left) if days_left == 0 else None
-                response_data['is_expired'] = now > expiry
-            except:
-                pass
-        else:
-            response_data['expiry_date'] = None
-            response_data['expires_in_days'] = None
-            response_data['is_expired'] = False
+        response_data.update(expiry_info(key_data, with_hours=True))
+        if not key_data.get('expiry_date'):
             response_data['note'] = "No expiry (Permanent until plan renewal)"
         
         return jsonify(response_data), 200
@@ -604,30 +777,34 @@ def get_usage():
             "error": str(e)
         }), 500
 
+# Service availability depends only on keys read at startup
+HEALTH_RESPONSE_JSON = orjson.dumps({
+    "status": "healthy",
+    "message": "API Gateway is running",
+    "version": "3.0",
+    "powered_by": "Claude 3.5 Sonnet + Pollinations AI",
+    "features": [
+        "🤖 AI Chat",
+        "🎨 Image Generation",
+        "🎬 Video Generation",
+        "💻 Code Expert",
+        "🔐 API Key Validation",
+        "⏱️ Expiry Tracking",
+        "📊 Usage Monitoring"
+    ],
+    "services": {
+        "claude_api": "available" if CLAUDE_API_KEY else "fallback",
+        "perplexity_api": "available" if PERPLEXITY_API_KEY else "disabled",
+        "pollinations_ai": "available",
+        "gemini_groq": "available"
+    }
+})
+
 @app.route('/health', methods=['GET'])
-def health():
+async def health():
     """Health check"""
-    return jsonify({
-        "status": "healthy",
-        "message": "API Gateway is running",
-        "version": "3.0",
-        "powered_by": "Claude 3.5 Sonnet + Pollinations AI",
-        "features": [
-            "🤖 AI Chat",
-            "🎨 Image Generation",
-            "🎬 Video Generation",
-            "💻 Code Expert",
-            "🔐 API Key Validation",
-            "⏱️ Expiry Tracking",
-            "📊 Usage Monitoring"
-        ],
-        "services": {
-            "claude_api": "available" if CLAUDE_API_KEY else "fallback",
-            "perplexity_api": "available" if PERPLEXITY_API_KEY else "disabled",
-            "pollinations_ai": "available",
-            "gemini_groq": "available"
-        }
-    }), 200
+    return Response(HEALTH_RESPONSE_JSON, mimetype='application/json', headers=HEALTH_CACHE_CONTROL)
 
 if __name__ == '__main__':
-    app.run(debug=True, host='0.0.0.0', port=5000)
+    import uvicorn
+    uvicorn.run(app, host='0.0.0.0', port=int(os.getenv('PORT', 5000)))
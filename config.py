@@ -1,6 +1,9 @@
 import os
+import functools
 from dotenv import load_dotenv
 
+# .env is parsed once, on first import of this module; everything else
+# reads the resolved values off Config instead of the environment
 load_dotenv()
 
 class Config:
@@ -14,8 +17,9 @@ class Config:
     # API Gateway Base URL (Your deployed Render URL)
     API_BASE_URL = os.getenv('API_BASE_URL', 'https://your-api.onrender.com')
     
-    # Admin Telegram IDs (comma separated)
-    ADMIN_IDS = os.getenv('ADMIN_IDS', '').split(',') if os.getenv('ADMIN_IDS') else []
+    # Admin Telegram IDs (comma separated) - parsed to ints once, so
+    # admin checks are a set lookup against update.effective_user.id
+    ADMIN_IDS = frozenset(int(x) for x in os.getenv('ADMIN_IDS', '').split(',') if x.strip())
     
     # Payment Gateway (Optional - for future integration)
     PAYMENT_GATEWAY_KEY = os.getenv('PAYMENT_GATEWAY_KEY', '')
@@ -24,6 +28,10 @@ class Config:
     RATE_LIMIT_FREE = int(os.getenv('RATE_LIMIT_FREE', 10))
     RATE_LIMIT_BASIC = int(os.getenv('RATE_LIMIT_BASIC', 100))
     RATE_LIMIT_PRO = int(os.getenv('RATE_LIMIT_PRO', 1000))
+    RATE_LIMITS = {'free': RATE_LIMIT_FREE, 'basic': RATE_LIMIT_BASIC, 'pro': RATE_LIMIT_PRO}
+    
+    # Redis (Optional - shares rate-limit counters across gateway workers)
+    REDIS_URL = os.getenv('REDIS_URL', '')
     
     # ===== AI Backend Configuration =====
     
@@ -36,14 +44,23 @@ class Config:
     # Groq API (Free)
     GROQ_API_KEY = os.getenv('GROQ_API_KEY', '')
     
+    # Claude API (Premium - code endpoint, optional)
+    CLAUDE_API_KEY = os.getenv('CLAUDE_API_KEY', '')
+    
     # Backend Selection
     # Options: 'perplexity', 'gemini', 'groq', 'auto'
     # 'auto' = Use Perplexity if available, else fallback to Gemini/Groq
     AI_BACKEND = os.getenv('AI_BACKEND', 'auto')
     
+    # Hedged fallback: seconds to wait on the first backend before also
+    # starting the next one. Doubles upstream calls for slow requests, so
+    # set it near the primary's p95 latency (e.g. 8); 0 = off (default)
+    AI_HEDGE_DELAY = float(os.getenv('AI_HEDGE_DELAY', 0))
+    
     @staticmethod
+    @functools.cache
     def get_available_backends():
-        """Get list of configured AI backends"""
+        """Get configured AI backends (keys are fixed at import, so computed once)"""
         backends = []
         
         if Config.PERPLEXITY_API_KEY:
@@ -53,9 +70,10 @@ class Config:
         if Config.GROQ_API_KEY:
             backends.append('groq')
         
-        return backends
+        return tuple(backends)
     
     @staticmethod
+    @functools.cache
     def is_perplexity_enabled():
-        """Check if Perplexity backend is available"""
+        """Check if Perplexity backend is available (computed once)"""
         return bool(Config.PERPLEXITY_API_KEY and len(Config.PERPLEXITY_API_KEY) > 20)
@@ -1,73 +1,243 @@
 import os
+import logging
+import asyncio
+import base64
+import hashlib
 import secrets
-import random
 import string
+from collections import Counter
 from datetime import datetime, timedelta
-from pymongo import MongoClient
+from pymongo import UpdateOne, ReturnDocument, WriteConcern
+from pymongo.errors import PyMongoError, DuplicateKeyError, OperationFailure, BulkWriteError
+from motor.motor_asyncio import AsyncIOMotorClient
+from cachetools import TTLCache
 from config import Config
 
+logger = logging.getLogger(__name__)
+
+# Fields each hot query's callers actually read - the rest of the
+# document (username, admin flag, updated_at) stays on the server
+VALIDATE_PROJECTION = {
+    '_id': 0, 'api_key': 1, 'telegram_id': 1, 'plan': 1, 'is_active': 1,
+    'expiry_date': 1, 'requests_used': 1, 'created_at': 1
+}
+ACTIVE_KEY_PROJECTION = {'_id': 0, 'api_key': 1, 'plan': 1, 'expiry_date': 1}
+PLAN_CHECK_PROJECTION = {'_id': 1}
+
+def hash_api_key(api_key):
+    """SHA-256 digest of an API key - the indexed lookup column"""
+    return hashlib.sha256(api_key.encode()).digest()
+
 class Database:
+    # Usage counts are buffered in memory and written in one bulk write
+    # every USAGE_FLUSH_INTERVAL seconds, or sooner once
+    # USAGE_FLUSH_THRESHOLD distinct keys are waiting.
+    USAGE_FLUSH_INTERVAL = 5.0
+    USAGE_FLUSH_THRESHOLD = 100
+    
+    # Set once ensure_indexes has run in this process
+    _indexes_ready = False
+    # Whether the one-active-key-per-plan unique index exists
+    _plan_key_index = False
+    
     def __init__(self):
-        """Initialize MongoDB connection"""
-        self.client = MongoClient(Config.MONGODB_URI)
+        """Initialize MongoDB connection (async, pooled)"""
+        self.client = AsyncIOMotorClient(
+            Config.MONGODB_URI,
+            maxPoolSize=100,
+            minPoolSize=10,
+            # Fail a request after 2.5s waiting for a free connection
+            # instead of queueing behind a saturated pool indefinitely
+            waitQueueTimeoutMS=2500,
+            # Negotiated with the server; zstd comes from the pymongo[zstd]
+            # extra and zlib is built in (snappy is left out - it needs
+            # python-snappy, and pymongo warns when it's listed but missing)
+            compressors='zstd,zlib',
+            retryWrites=True,
+            serverSelectionTimeoutMS=3000,
+            socketTimeoutMS=10000
+        )
         self.db = self.client[Config.DB_NAME]
         self.users = self.db['users']
         self.api_keys = self.db['api_keys']
+        # Same collection, acknowledged by the primary without waiting for
+        # the journal or replicas - only for usage counters, where losing
+        # the last flush on a crash is acceptable
+        self._api_keys_fast = self.db.get_collection(
+            'api_keys', write_concern=WriteConcern(w=1, j=False)
+        )
         self.gift_cards = self.db['gift_cards']
+        self.payments = self.db['payments']
+        
+        # Valid key documents by API key - validate_api_key is called on
+        # every gateway request. Changes made through this instance drop
+        # the entry; changes from another process show up within the TTL.
+        self._validate_cache = TTLCache(maxsize=10_000, ttl=30)
+        # User documents by Telegram ID - register_user drops the entry
+        self._user_cache = TTLCache(maxsize=10_000, ttl=60)
+        self._stats_cache = TTLCache(maxsize=1, ttl=self.STATS_TTL)
+        
+        # Usage counts not yet written, by API key (see flush_usage)
+        self._usage_buffer = Counter()
+        self._usage_flush_now = asyncio.Event()
+        
+        # Entropy pool for generate_api_key - filled on first use
+        self._entropy_buf = b''
+        self._entropy_pos = 0
+        self._entropy_pid = None
+    
+    async def ensure_indexes(self):
+        """Create indexes (call at startup, inside the event loop)
         
-        # Create indexes
-        self.users.create_index('telegram_id', unique=True)
-        self.api_keys.create_index('api_key', unique=True)
-        self.api_keys.create_index('telegram_id')
-        self.gift_cards.create_index('code', unique=True)
+        Only the first call per process talks to the server - later ones
+        (another app sharing the process, a restarted startup hook) return
+        straight away.
+        """
+        if Database._indexes_ready:
+            return
+        await self.users.create_index('telegram_id', unique=True)
+        # Plaintext keys are still stored: usage flushes, deletes and the
+        # no-hash fallback in validate_api_key look them up by this index
+        await self.api_keys.create_index('api_key', unique=True)
+        await self._backfill_api_key_hashes()
+        await self._migrate_expiry_dates()
+        # Partial so keys inserted by a not-yet-upgraded process don't collide on a missing hash
+        await self.api_keys.create_index(
+            'api_key_hash', unique=True,
+            partialFilterExpression={'api_key_hash': {'$exists': True}}
+        )
+        # Equality fields first, then the expiry range: the (telegram_id,
+        # is_active) prefix serves get_active_api_keys, the full index
+        # covers has_active_plan, and telegram_id alone the per-user listings
+        await self.api_keys.create_index([('telegram_id', 1), ('is_active', 1), ('plan', 1), ('expiry_date', 1)])
+        try:
+            # Superseded by the index above
+            await self.api_keys.drop_index('telegram_id_1_plan_1_is_active_1')
+        except OperationFailure:
+            pass
+        await self.api_keys.create_index([('is_active', 1), ('expiry_date', 1)])
+        # One active self-serve key per user and plan, enforced by the server
+        # so create_api_key can just insert (admin-created keys are exempt)
+        try:
+            await self.api_keys.create_index(
+                [('telegram_id', 1), ('plan', 1)], unique=True, name='one_active_plan_key',
+                partialFilterExpression={'is_active': True, 'created_by_admin': False}
+            )
+            Database._plan_key_index = True
+        except OperationFailure as e:
+            # Existing duplicates - keep checking in create_api_key instead
+            logger.warning("One-key-per-plan index not created: %s", e)
+        # Newest-first admin listings, optionally of active keys only
+        await self.api_keys.create_index([('created_at', -1)])
+        await self.api_keys.create_index([('is_active', 1), ('created_at', -1)])
+        await self.gift_cards.create_index('code', unique=True)
+        # Newest-first /giftlist
+        await self.gift_cards.create_index([('created_at', -1)])
+        await self.payments.create_index('reference', unique=True)
+        await self.payments.create_index([('status', 1), ('created_at', 1)])
+        await self.payments.create_index([('user_id', 1), ('created_at', 1)])
+        # Payment requests (paid or not) are dropped by the server after a week
+        await self.payments.create_index('created_at', expireAfterSeconds=self.PAYMENT_TTL)
+        Database._indexes_ready = True
+    
+    async def close(self):
+        """Write pending usage counts and close the connection pool (call on shutdown)"""
+        await self.flush_usage()
+        self.client.close()
+    
+    async def _backfill_api_key_hashes(self):
+        """Add api_key_hash to keys created before it existed"""
+        ops = []
+        async for key in self.api_keys.find({'api_key_hash': {'$exists': False}}, {'api_key': 1}):
+            ops.append(UpdateOne({'_id': key['_id']}, {'$set': {'api_key_hash': hash_api_key(key['api_key'])}}))
+            if len(ops) >= 500:
+                await self.api_keys.bulk_write(ops, ordered=False)
+                ops = []
+        if ops:
+            await self.api_keys.bulk_write(ops, ordered=False)
+    
+    async def _migrate_expiry_dates(self):
+        """Convert ISO-string expiry dates from older versions to BSON dates"""
+        ops = []
+        async for key in self.api_keys.find({'expiry_date': {'$type': 'string'}}, {'expiry_date': 1}):
+            ops.append(UpdateOne(
+                {'_id': key['_id']},
+                {'$set': {'expiry_date': datetime.fromisoformat(key['expiry_date'])}}
+            ))
+            if len(ops) >= 500:
+                await self.api_keys.bulk_write(ops, ordered=False)
+                ops = []
+        if ops:
+            await self.api_keys.bulk_write(ops, ordered=False)
+    
+    # Random bytes per API key (same as secrets.token_urlsafe(32))
+    API_KEY_BYTES = 32
     
     def generate_api_key(self):
-        """Generate a unique API key"""
-        return f"sk-{secrets.token_urlsafe(32)}"
+        """Generate a unique API key
+        
+        Draws from a pre-read os.urandom pool (same source as secrets)
+        so bulk key creation doesn't make a syscall per key. The pool is
+        dropped if the process forked, so workers never share bytes.
+        """
+        if self._entropy_pid != os.getpid() or self._entropy_pos + self.API_KEY_BYTES > len(self._entropy_buf):
+            self._entropy_buf = os.urandom(self.API_KEY_BYTES * 1024)
+            self._entropy_pos = 0
+            self._entropy_pid = os.getpid()
+        start = self._entropy_pos
+        self._entropy_pos = start + self.API_KEY_BYTES
+        token = base64.urlsafe_b64encode(self._entropy_buf[start:self._entropy_pos]).rstrip(b'=').decode()
+        return f"sk-{token}"
+    
+    GIFT_CODE_ALPHABET = string.ascii_uppercase + string.digits
     
     def generate_gift_code(self):
-        """Generate a unique gift card code"""
-        parts = []
-        for _ in range(3):
-            part = ''.join(random.choices(string.ascii_uppercase + string.digits, k=4))
-            parts.append(part)
-        return f"GIFT-{'-'.join(parts)}"
-    
-    def register_user(self, telegram_id, username):
-        """Register user in database"""
-        try:
-            existing = self.users.find_one({'telegram_id': telegram_id})
-            if not existing:
-                user_data = {
-                    'telegram_id': telegram_id,
-                    'username': username,
-                    'created_at': datetime.now().isoformat(),
-                    'updated_at': datetime.now().isoformat()
-                }
-                self.users.insert_one(user_data)
-            else:
-                # Update username if changed
-                self.users.update_one(
-                    {'telegram_id': telegram_id},
-                    {'$set': {'username': username, 'updated_at': datetime.now().isoformat()}}
-                )
-            return True
+        """Generate a unique gift card code
+        
+        Gift codes grant paid access, so the 12 characters come from one
+        unbiased secrets draw rather than the random module.
+        """
+        n = secrets.randbelow(36 ** 12)
+        chars = []
+        for _ in range(12):
+            n, i = divmod(n, 36)
+            chars.append(self.GIFT_CODE_ALPHABET[i])
+        s = ''.join(chars)
+        return f"GIFT-{s[0:4]}-{s[4:8]}-{s[8:12]}"
+    
+    async def register_user(self, telegram_id, username):
+        """Register user in database (or refresh their username) in one upsert
+        
+        Returns True only when the user was created by this call.
+        """
+        self._user_cache.pop(telegram_id, None)
+        try:
+            now = datetime.now().isoformat()
+            result = await self.users.update_one(
+                {'telegram_id': telegram_id},
+                {
+                    '$setOnInsert': {'created_at': now},
+                    '$set': {'username': username, 'updated_at': now}
+                },
+                upsert=True
+            )
+            return result.upserted_id is not None
         except Exception as e:
-            print(f"Error registering user: {e}")
+            logger.error("Error registering user: %s", e)
             return False
     
-    def create_user(self, telegram_id, username):
+    async def create_user(self, telegram_id, username):
         """Alias for register_user"""
-        return self.register_user(telegram_id, username)
+        return await self.register_user(telegram_id, username)
     
     # ========== API KEYS ==========
     
-    def create_api_key(self, telegram_id, username, plan='free', expiry_days=None, created_by_admin=False):
+    async def create_api_key(self, telegram_id, username, plan='free', expiry_days=None, created_by_admin=False):
         """Create new API key for user"""
-        self.create_user(telegram_id, username)
+        await self.create_user(telegram_id, username)
         
-        if not created_by_admin:
-            existing_plan_key = self.api_keys.find_one({
+        if not created_by_admin and not Database._plan_key_index:
+            existing_plan_key = await self.api_keys.find_one({
                 'telegram_id': telegram_id,
                 'plan': plan,
                 'is_active': True
@@ -78,68 +248,85 @@ class Database:
         
         api_key = self.generate_api_key()
         
+        now = datetime.now()
+        created_at = now.isoformat()
         expiry_date = None
         if expiry_days and expiry_days > 0:
-            expiry_date = (datetime.now() + timedelta(days=expiry_days)).isoformat()
+            expiry_date = now + timedelta(days=expiry_days)
         
         key_data = {
             'telegram_id': telegram_id,
-            'username': username,
             'api_key': api_key,
+            'api_key_hash': hash_api_key(api_key),
             'plan': plan,
             'requests_used': 0,
             'is_active': True,
             'expiry_date': expiry_date,
             'created_by_admin': created_by_admin,
-            'created_at': datetime.now().isoformat(),
-            'updated_at': datetime.now().isoformat()
+            'created_at': created_at,
+            'updated_at': created_at
         }
         
         try:
-            self.api_keys.insert_one(key_data)
+            await self.api_keys.insert_one(key_data)
             return api_key
+        except DuplicateKeyError:
+            # Already has an active key for this plan
+            return None
         except Exception as e:
-            print(f"Error creating API key: {e}")
+            logger.error("Error creating API key: %s", e)
             return None
     
-    def delete_api_key(self, api_key):
+    async def delete_api_key(self, api_key):
         """Delete API key permanently"""
+        self._validate_cache.pop(api_key, None)
         try:
-            result = self.api_keys.delete_one({'api_key': api_key})
+            result = await self.api_keys.delete_one({'api_key': api_key})
             return result.deleted_count > 0
         except Exception as e:
-            print(f"Error deleting API key: {e}")
+            logger.error("Error deleting API key: %s", e)
             return False
     
-    def delete_api_key_by_telegram_id(self, telegram_id, plan=None):
+    async def delete_api_key_by_telegram_id(self, telegram_id, plan=None):
         """Delete API key by telegram ID and optional plan"""
+        for api_key, key in list(self._validate_cache.items()):
+            if key['telegram_id'] == telegram_id and (not plan or key['plan'] == plan):
+                self._validate_cache.pop(api_key, None)
         try:
             query = {'telegram_id': telegram_id}
             if plan:
                 query['plan'] = plan
-            result = self.api_keys.delete_many(query)
+            result = await self.api_keys.delete_many(query)
             return result.deleted_count
         except Exception as e:
-            print(f"Error deleting API keys: {e}")
+            logger.error("Error deleting API keys: %s", e)
             return 0
     
     # ========== GIFT CARDS ==========
     
-    def create_gift_card(self, plan, max_uses, card_expiry_days=None, api_expiry_days=None, created_by=None, note=""):
+    async def create_gift_card(self, plan, max_uses, card_expiry_days=None, api_expiry_days=None, created_by=None, note=""):
         """Create a gift card for redeeming API keys"""
-        code = self.generate_gift_code()
-        
+        codes = await self.create_gift_cards(1, plan, max_uses, card_expiry_days, api_expiry_days, created_by, note)
+        return codes[0] if codes else None
+    
+    # Rounds of fresh codes create_gift_cards tries for cards whose code collided
+    GIFT_INSERT_ATTEMPTS = 3
+    
+    async def create_gift_cards(self, count, plan, max_uses, card_expiry_days=None, api_expiry_days=None, created_by=None, note=""):
+        """Create count gift cards in one insert; returns the codes that were stored"""
+        now = datetime.now()
+        created_at = now.isoformat()
         card_expiry = None
         if card_expiry_days and card_expiry_days > 0:
-            card_expiry = (datetime.now() + timedelta(days=card_expiry_days)).isoformat()
+            card_expiry = (now + timedelta(days=card_expiry_days)).isoformat()
         
         if api_expiry_days is None:
             api_expiry_days = 7 if plan == 'free' else None
         elif api_expiry_days == 0:
             api_expiry_days = None
         
-        gift_data = {
-            'code': code,
+        gifts = [{
+            'code': self.generate_gift_code(),
             'plan': plan,
             'max_uses': max_uses,
             'used_count': 0,
@@ -149,40 +336,60 @@ class Database:
             'api_expiry_days': api_expiry_days,
             'created_by': created_by,
             'note': note,
-            'created_at': datetime.now().isoformat(),
-            'updated_at': datetime.now().isoformat()
-        }
+            'created_at': created_at,
+            'updated_at': created_at
+        } for _ in range(count)]
         
+        codes = []
         try:
-            self.gift_cards.insert_one(gift_data)
-            return code
+            for _ in range(self.GIFT_INSERT_ATTEMPTS):
+                try:
+                    await self.gift_cards.insert_many(gifts, ordered=False)
+                    codes.extend(gift['code'] for gift in gifts)
+                    return codes
+                except BulkWriteError as e:
+                    # Unordered - everything but the failed documents was stored
+                    errors = e.details.get('writeErrors', [])
+                    failed = {err['index'] for err in errors}
+                    codes.extend(gift['code'] for i, gift in enumerate(gifts) if i not in failed)
+                    if any(err.get('code') != 11000 for err in errors):
+                        raise
+                    # Code collisions only - retry those cards with fresh codes
+                    gifts = [gifts[i] for i in sorted(failed)]
+                    for gift in gifts:
+                        gift.pop('_id', None)
+                        gift['code'] = self.generate_gift_code()
+            logger.error("Error creating %d of %d gift cards: duplicate codes", len(gifts), count)
         except Exception as e:
-            print(f"Error creating gift card: {e}")
-            return None
+            logger.error("Error creating gift card: %s", e)
+        return codes
     
-    def redeem_gift_card(self, code, telegram_id, username):
+    async def redeem_gift_card(self, code, telegram_id, username):
         """Redeem a gift card and create API key"""
+        code = code.upper()
         try:
-            gift = self.gift_cards.find_one({'code': code.upper()})
-            
+            # Claim a use only if every precondition still holds, so two
+            # concurrent redemptions can't both take the last use
+            now = datetime.now().isoformat()
+            gift = await self.gift_cards.find_one_and_update(
+                {
+                    'code': code,
+                    'is_active': True,
+                    '$or': [{'card_expiry': None}, {'card_expiry': {'$gt': now}}],
+                    '$expr': {'$lt': ['$used_count', '$max_uses']},
+                    'used_by': {'$ne': telegram_id}
+                },
+                {
+                    '$inc': {'used_count': 1},
+                    '$push': {'used_by': telegram_id},
+                    '$set': {'updated_at': now}
+                },
+                projection={'_id': 0, 'plan': 1, 'api_expiry_days': 1}
+            )
             if not gift:
-                return {'success': False, 'error': 'Invalid gift code'}
-            
-            if not gift.get('is_active'):
-                return {'success': False, 'error': 'Gift code is no longer active'}
-            
-            if gift.get('card_expiry'):
-                expiry = datetime.fromisoformat(gift['card_expiry'])
-                if datetime.now() > expiry:
-                    return {'success': False, 'error': 'Gift code has expired'}
+                return {'success': False, 'error': await self._gift_card_error(code, telegram_id)}
             
-            if gift['used_count'] >= gift['max_uses']:
-                return {'success': False, 'error': 'Gift code has been fully redeemed'}
-            
-            if telegram_id in gift.get('used_by', []):
-                return {'success': False, 'error': 'You have already used this gift code'}
-            
-            api_key = self.create_api_key(
+            api_key = await self.create_api_key(
                 telegram_id=telegram_id,
                 username=username,
                 plan=gift['plan'],
@@ -191,17 +398,13 @@ class Database:
             )
             
             if not api_key:
+                # Give the use back - no key was issued for it
+                await self.gift_cards.update_one(
+                    {'code': code, 'used_by': telegram_id},
+                    {'$inc': {'used_count': -1}, '$pull': {'used_by': telegram_id}}
+                )
                 return {'success': False, 'error': f'You already have an active {gift["plan"]} plan key'}
             
-            self.gift_cards.update_one(
-                {'code': code.upper()},
-                {
-                    '$inc': {'used_count': 1},
-                    '$push': {'used_by': telegram_id},
-                    '$set': {'updated_at': datetime.now().isoformat()}
-                }
-            )
-            
             return {
                 'success': True,
                 'api_key': api_key,
@@ -210,16 +413,32 @@ class Database:
             }
             
         except Exception as e:
-            print(f"Error redeeming gift card: {e}")
+            logger.error("Error redeeming gift card: %s", e)
             return {'success': False, 'error': str(e)}
     
-    def update_gift_card_api_expiry(self, code, api_expiry_days):
+    async def _gift_card_error(self, code, telegram_id):
+        """Why a gift card can't be redeemed (after the guarded claim failed)"""
+        gift = await self.gift_cards.find_one({'code': code})
+        if not gift:
+            return 'Invalid gift code'
+        if not gift.get('is_active'):
+            return 'Gift code is no longer active'
+        if gift.get('card_expiry') and datetime.now() > datetime.fromisoformat(gift['card_expiry']):
+            return 'Gift code has expired'
+        if gift['used_count'] >= gift['max_uses']:
+            return 'Gift code has been fully redeemed'
+        if telegram_id in gift.get('used_by', []):
+            return 'You have already used this gift code'
+        # Changed between the two reads
+        return 'Gift code could not be redeemed, please try again'
+    
+    async def update_gift_card_api_expiry(self, code, api_expiry_days):
         """Update API key expiry days for a gift card"""
         try:
             if api_expiry_days is not None and api_expiry_days <= 0:
                 api_expiry_days = None
             
-            self.gift_cards.update_one(
+            await self.gift_cards.update_one(
                 {'code': code.upper()},
                 {
                     '$set': {
@@ -230,31 +449,36 @@ class Database:
             )
             return True
         except Exception as e:
-            print(f"Error updating gift card: {e}")
+            logger.error("Error updating gift card: %s", e)
             return False
     
-    def get_gift_card(self, code):
+    async def get_gift_card(self, code):
         """Get gift card details"""
         try:
-            gift = self.gift_cards.find_one({'code': code.upper()})
+            gift = await self.gift_cards.find_one({'code': code.upper()})
             return gift
         except Exception as e:
-            print(f"Error getting gift card: {e}")
+            logger.error("Error getting gift card: %s", e)
             return None
     
-    def get_all_gift_cards(self):
-        """Get all gift cards (admin)"""
+    async def iter_all_gift_cards(self, projection=None):
+        """Yield every gift card, newest first (admin)
+        
+        Errors propagate, even mid-stream, so /giftlist never shows counts
+        from a partial scan.
+        """
         try:
-            gifts = list(self.gift_cards.find().sort('created_at', -1))
-            return gifts
-        except Exception as e:
-            print(f"Error getting gift cards: {e}")
-            return []
-    
-    def deactivate_gift_card(self, code):
+            cursor = self.gift_cards.find({}, projection).sort('created_at', -1).batch_size(self.SCAN_BATCH_SIZE)
+            async for gift in cursor:
+                yield gift
+        except PyMongoError as e:
+            logger.error("Error getting gift cards: %s", e)
+            raise
+    
+    async def deactivate_gift_card(self, code):
         """Deactivate a gift card"""
         try:
-            self.gift_cards.update_one(
+            await self.gift_cards.update_one(
                 {'code': code.upper()},
                 {
                     '$set': {
@@ -265,116 +489,229 @@ class Database:
             )
             return True
         except Exception as e:
-            print(f"Error deactivating gift card: {e}")
+            logger.error("Error deactivating gift card: %s", e)
             return False
     
-    def delete_gift_card(self, code):
+    async def delete_gift_card(self, code):
         """Delete a gift card permanently"""
         try:
-            result = self.gift_cards.delete_one({'code': code.upper()})
+            result = await self.gift_cards.delete_one({'code': code.upper()})
             return result.deleted_count > 0
         except Exception as e:
-            print(f"Error deleting gift card: {e}")
+            logger.error("Error deleting gift card: %s", e)
             return False
     
+    # ========== PAYMENTS ==========
+    
+    # Seconds a payment request is kept (TTL index on created_at)
+    PAYMENT_TTL = 7 * 86400
+    
+    async def save_payment(self, payment):
+        """Store a payment request, replacing any with the same reference"""
+        try:
+            await self.payments.replace_one({'reference': payment['reference']}, payment, upsert=True)
+            return True
+        except Exception as e:
+            logger.error("Error saving payment: %s", e)
+            return False
+    
+    async def get_payment(self, reference):
+        """Get a payment request by reference"""
+        try:
+            return await self.payments.find_one({'reference': reference}, {'_id': 0})
+        except Exception as e:
+            logger.error("Error getting payment: %s", e)
+            return None
+    
+    async def mark_payment_verified(self, reference):
+        """Mark a pending payment verified (False if it wasn't pending)"""
+        try:
+            result = await self.payments.update_one(
+                {'reference': reference, 'status': 'pending'},
+                {'$set': {'status': 'verified', 'verified_at': datetime.now()}}
+            )
+            return result.modified_count > 0
+        except Exception as e:
+            logger.error("Error verifying payment: %s", e)
+            return False
+    
+    async def get_pending_payments(self):
+        """Pending payment requests, oldest first (admin)"""
+        try:
+            return await self.payments.find({'status': 'pending'}, {'_id': 0}).sort('created_at', 1).to_list(length=None)
+        except Exception as e:
+            logger.error("Error getting pending payments: %s", e)
+            return []
+    
+    async def get_user_payments(self, user_id):
+        """A user's payment requests, oldest first"""
+        try:
+            return await self.payments.find({'user_id': user_id}, {'_id': 0}).sort('created_at', 1).to_list(length=None)
+        except Exception as e:
+            logger.error("Error getting payments: %s", e)
+            return []
+    
     # ========== VALIDATION & QUERIES ==========
     
-    def validate_api_key(self, api_key):
-        """Validate API key and return key data"""
+    async def validate_api_key(self, api_key):
+        """Validate API key and return key data
+        
+        Returns None only for unknown or expired keys - database errors
+        propagate, so callers don't mistake an outage for a bad key.
+        """
+        key = self._validate_cache.get(api_key)
+        if key is not None:
+            # Expired while cached - fall through so the DB path deactivates it
+            if not key.get('expiry_date') or datetime.now() <= key['expiry_date']:
+                return key
+            self._validate_cache.pop(api_key, None)
+        
         try:
-            key = self.api_keys.find_one({'api_key': api_key})
+            # Fetch and, if expired, deactivate in one atomic round trip
+            now = datetime.now()
+            expired = {'$and': [
+                {'$eq': [{'$type': '$expiry_date'}, 'date']},
+                {'$lte': ['$expiry_date', now]}
+            ]}
+            key_hash = hash_api_key(api_key)
+            update = {
+                'is_active': {'$cond': [expired, False, '$is_active']},
+                'updated_at': {'$cond': [expired, now.isoformat(), '$updated_at']}
+            }
+            key = await self.api_keys.find_one_and_update(
+                {'api_key_hash': key_hash},
+                [{'$set': update}],
+                projection=VALIDATE_PROJECTION,
+                return_document=ReturnDocument.AFTER
+            )
+            if not key:
+                # Inserted without a hash (by a process from before
+                # api_key_hash existed) - find it by the key and add the hash
+                key = await self.api_keys.find_one_and_update(
+                    {'api_key': api_key, 'api_key_hash': {'$exists': False}},
+                    [{'$set': {**update, 'api_key_hash': key_hash}}],
+                    projection=VALIDATE_PROJECTION,
+                    return_document=ReturnDocument.AFTER
+                )
             if not key:
                 return None
             
-            if key.get('expiry_date'):
-                expiry = datetime.fromisoformat(key['expiry_date'])
-                if datetime.now() > expiry:
-                    self.deactivate_api_key(api_key)
-                    return None
+            if key.get('expiry_date') and key['expiry_date'] <= now:
+                return None
             
+            self._validate_cache[api_key] = key
             return key
-        except Exception as e:
-            print(f"Error validating API key: {e}")
-            return None
+        except PyMongoError as e:
+            logger.error("Error validating API key: %s", e)
+            raise
     
-    def get_user_by_telegram_id(self, telegram_id):
+    async def get_user_by_telegram_id(self, telegram_id):
         """Get user by Telegram ID"""
+        user = self._user_cache.get(telegram_id)
+        if user is not None:
+            return user
         try:
-            user = self.users.find_one({'telegram_id': telegram_id})
+            user = await self.users.find_one({'telegram_id': telegram_id})
+            if user:
+                self._user_cache[telegram_id] = user
             return user
         except Exception as e:
-            print(f"Error getting user: {e}")
+            logger.error("Error getting user: %s", e)
             return None
     
-    def get_user_api_keys(self, telegram_id):
+    async def get_user_api_keys(self, telegram_id, projection=None):
         """Get all API keys for a user"""
         try:
-            keys = list(self.api_keys.find({'telegram_id': telegram_id}))
+            keys = await self.api_keys.find({'telegram_id': telegram_id}, projection).to_list(length=None)
             return keys
         except Exception as e:
-            print(f"Error getting API keys: {e}")
+            logger.error("Error getting API keys: %s", e)
             return []
     
-    def get_active_api_keys(self, telegram_id):
+    @staticmethod
+    def _not_expired():
+        """Query clause matching keys with no expiry or one still ahead"""
+        return {'$or': [{'expiry_date': None}, {'expiry_date': {'$gt': datetime.now()}}]}
+    
+    async def get_active_api_keys(self, telegram_id):
         """Get only active API keys for a user"""
         try:
-            keys = list(self.api_keys.find({
+            # Expired keys are left for deactivate_expired_keys to switch off
+            keys = await self.api_keys.find({
                 'telegram_id': telegram_id,
-                'is_active': True
-            }))
-            
-            active_keys = []
-            for key in keys:
-                if key.get('expiry_date'):
-                    expiry = datetime.fromisoformat(key['expiry_date'])
-                    if datetime.now() > expiry:
-                        self.deactivate_api_key(key['api_key'])
-                        continue
-                active_keys.append(key)
-            
-            return active_keys
+                'is_active': True,
+                **self._not_expired()
+            }, ACTIVE_KEY_PROJECTION).to_list(length=None)
+            return keys
         except Exception as e:
-            print(f"Error getting active keys: {e}")
+            logger.error("Error getting active keys: %s", e)
             return []
     
-    def has_active_plan(self, telegram_id, plan):
+    async def has_active_plan(self, telegram_id, plan):
         """Check if user has active key for specific plan"""
         try:
-            key = self.api_keys.find_one({
+            key = await self.api_keys.find_one({
                 'telegram_id': telegram_id,
                 'plan': plan,
-                'is_active': True
-            })
-            
-            if key and key.get('expiry_date'):
-                expiry = datetime.fromisoformat(key['expiry_date'])
-                if datetime.now() > expiry:
-                    return False
-            
+                'is_active': True,
+                **self._not_expired()
+            }, PLAN_CHECK_PROJECTION)
             return key is not None
         except Exception as e:
-            print(f"Error checking plan: {e}")
+            logger.error("Error checking plan: %s", e)
             return False
     
-    def increment_usage(self, api_key):
-        """Increment API usage counter"""
+    def increment_usage(self, api_key, key_data=None):
+        """Count one request for api_key; the DB catches up on flush_usage
+        
+        key_data is the document to bump so callers see the new count -
+        defaults to the cached one.
+        """
+        if key_data is None:
+            key_data = self._validate_cache.get(api_key)
+        if key_data is not None:
+            key_data['requests_used'] += 1
+        self._usage_buffer[api_key] += 1
+        if len(self._usage_buffer) >= self.USAGE_FLUSH_THRESHOLD:
+            self._usage_flush_now.set()
+    
+    async def flush_usage(self):
+        """Write buffered usage counts in one round trip"""
+        if not self._usage_buffer:
+            return True
+        counts = dict(self._usage_buffer)
+        self._usage_buffer.clear()
         try:
-            self.api_keys.update_one(
-                {'api_key': api_key},
-                {
-                    '$inc': {'requests_used': 1},
-                    '$set': {'updated_at': datetime.now().isoformat()}
-                }
-            )
+            now = datetime.now().isoformat()
+            await self._api_keys_fast.bulk_write([
+                UpdateOne(
+                    {'api_key': api_key},
+                    {'$inc': {'requests_used': n}, '$set': {'updated_at': now}}
+                )
+                for api_key, n in counts.items()
+            ], ordered=False)
             return True
         except Exception as e:
-            print(f"Error incrementing usage: {e}")
+            logger.error("Error flushing usage: %s", e)
+            # Keep the counts for the next flush rather than losing them
+            self._usage_buffer.update(counts)
             return False
     
-    def deactivate_api_key(self, api_key):
+    async def flush_usage_periodically(self):
+        """Run flush_usage forever (start as a task; flush once more on shutdown)"""
+        while True:
+            try:
+                await asyncio.wait_for(self._usage_flush_now.wait(), self.USAGE_FLUSH_INTERVAL)
+            except asyncio.TimeoutError:
+                pass
+            self._usage_flush_now.clear()
+            await self.flush_usage()
+    
+    async def deactivate_api_key(self, api_key):
         """Deactivate an API key"""
+        self._validate_cache.pop(api_key, None)
         try:
-            self.api_keys.update_one(
+            await self.api_keys.update_one(
                 {'api_key': api_key},
                 {
                     '$set': {
@@ -385,13 +722,14 @@ class Database:
             )
             return True
         except Exception as e:
-            print(f"Error deactivating key: {e}")
+            logger.error("Error deactivating key: %s", e)
             return False
     
-    def activate_api_key(self, api_key):
+    async def activate_api_key(self, api_key):
         """Activate an API key"""
+        self._validate_cache.pop(api_key, None)
         try:
-            self.api_keys.update_one(
+            await self.api_keys.update_one(
                 {'api_key': api_key},
                 {
                     '$set': {
@@ -402,34 +740,37 @@ class Database:
             )
             return True
         except Exception as e:
-            print(f"Error activating key: {e}")
+            logger.error("Error activating key: %s", e)
             return False
     
-    def set_expiry(self, api_key, days):
+    async def set_expiry(self, api_key, days):
         """Set expiry date for API key"""
+        self._validate_cache.pop(api_key, None)
         try:
             if days <= 0:
-                return self.remove_expiry(api_key)
+                return await self.remove_expiry(api_key)
             
-            expiry_date = (datetime.now() + timedelta(days=days)).isoformat()
-            self.api_keys.update_one(
+            now = datetime.now()
+            expiry_date = now + timedelta(days=days)
+            await self.api_keys.update_one(
                 {'api_key': api_key},
                 {
                     '$set': {
                         'expiry_date': expiry_date,
-                        'updated_at': datetime.now().isoformat()
+                        'updated_at': now.isoformat()
                     }
                 }
             )
             return True
         except Exception as e:
-            print(f"Error setting expiry: {e}")
+            logger.error("Error setting expiry: %s", e)
             return False
     
-    def remove_expiry(self, api_key):
+    async def remove_expiry(self, api_key):
         """Remove expiry date (make permanent)"""
+        self._validate_cache.pop(api_key, None)
         try:
-            self.api_keys.update_one(
+            await self.api_keys.update_one(
                 {'api_key': api_key},
                 {
                     '$set': {
@@ -440,53 +781,121 @@ class Database:
             )
             return True
         except Exception as e:
-            print(f"Error removing expiry: {e}")
+            logger.error("Error removing expiry: %s", e)
             return False
     
     # ========== ADMIN FUNCTIONS ==========
     
-    def get_all_users(self):
-        """Get all users (admin function)"""
+    # Cursor batch size for full-collection scans - documents are yielded
+    # as each batch arrives instead of materialising the whole collection
+    SCAN_BATCH_SIZE = 500
+    
+    async def iter_all_users(self, projection=None):
+        """Yield every user (admin function)
+        
+        Errors propagate, even mid-stream - a truncated listing must not
+        pass for a complete one.
+        """
+        try:
+            async for user in self.users.find({}, projection).batch_size(self.SCAN_BATCH_SIZE):
+                yield user
+        except PyMongoError as e:
+            logger.error("Error getting users: %s", e)
+            raise
+    
+    async def iter_all_api_keys(self, projection=None):
+        """Yield every API key (admin function; errors propagate like iter_all_users)"""
+        try:
+            async for key in self.api_keys.find({}, projection).batch_size(self.SCAN_BATCH_SIZE):
+                yield key
+        except PyMongoError as e:
+            logger.error("Error getting API keys: %s", e)
+            raise
+    
+    async def get_api_keys_page(self, limit=100, before=None, active=None, projection=None):
+        """Newest API keys first, one page at a time, with the owner's username (admin function)
+        
+        Pass the last key's created_at as before= to get the next page -
+        a range on the index instead of a skip that rescans earlier pages.
+        Usernames live only on users, so they are joined in for the page.
+        """
         try:
-            users = list(self.users.find())
-            return users
+            query = {}
+            if active is not None:
+                query['is_active'] = active
+            if before:
+                query['created_at'] = {'$lt': before}
+            pipeline = [
+                {'$match': query},
+                {'$sort': {'created_at': -1}},
+                {'$limit': limit},
+                {'$lookup': {
+                    'from': 'users',
+                    'localField': 'telegram_id',
+                    'foreignField': 'telegram_id',
+                    'as': 'user'
+                }},
+                {'$set': {'username': {'$arrayElemAt': ['$user.username', 0]}}},
+                {'$project': projection} if projection else {'$unset': 'user'}
+            ]
+            return await self.api_keys.aggregate(pipeline).to_list(length=limit)
         except Exception as e:
-            print(f"Error getting users: {e}")
+            logger.error("Error getting API keys: %s", e)
             return []
     
-    def get_all_api_keys(self):
-        """Get all API keys (admin function)"""
+    async def count_api_keys(self):
+        """Total and active API key counts (admin function)"""
         try:
-            keys = list(self.api_keys.find())
-            return keys
+            total, active = await asyncio.gather(
+                self.api_keys.estimated_document_count(),
+                self.api_keys.count_documents({'is_active': True})
+            )
+            return total, active
         except Exception as e:
-            print(f"Error getting API keys: {e}")
-            return []
-    
-    def get_stats(self):
-        """Get system statistics"""
+            logger.error("Error counting API keys: %s", e)
+            return 0, 0
+    
+    # Seconds get_stats reuses its last result - the bot's health page
+    # (polled by the host) would otherwise scan api_keys on every ping
+    STATS_TTL = 30
+    
+    async def get_stats(self, fresh=False):
+        """Get system statistics (pass fresh=True to skip the short-lived cache)"""
+        if not fresh:
+            stats = self._stats_cache.get('stats')
+            if stats is not None:
+                return stats
         try:
-            total_users = self.users.count_documents({})
-            total_keys = self.api_keys.count_documents({})
-            active_keys = self.api_keys.count_documents({'is_active': True})
-            total_gifts = self.gift_cards.count_documents({})
-            active_gifts = self.gift_cards.count_documents({'is_active': True})
-            
-            # Total requests
-            pipeline = [
-                {'$group': {'_id': None, 'total': {'$sum': '$requests_used'}}}
-            ]
-            result = list(self.api_keys.aggregate(pipeline))
-            total_requests = result[0]['total'] if result else 0
+            # One pass over each collection for all of its counters, with
+            # the three queries in flight at once. The user total is read
+            # from collection metadata instead of scanning.
+            active = {'$cond': [{'$eq': ['$is_active', True]}, 1, 0]}
+            total_users, key_result, gift_result = await asyncio.gather(
+                self.users.estimated_document_count(),
+                self.api_keys.aggregate([{'$group': {
+                    '_id': None,
+                    'total': {'$sum': 1},
+                    'active': {'$sum': active},
+                    'requests': {'$sum': '$requests_used'}
+                }}]).to_list(length=None),
+                self.gift_cards.aggregate([{'$group': {
+                    '_id': None,
+                    'total': {'$sum': 1},
+                    'active': {'$sum': active},
+                    'redemptions': {'$sum': '$used_count'}
+                }}]).to_list(length=None)
+            )
             
-            # Total gift redemptions
-            gift_pipeline = [
-                {'$group': {'_id': None, 'total': {'$sum': '$used_count'}}}
-            ]
-            gift_result = list(self.gift_cards.aggregate(gift_pipeline))
-            total_redemptions = gift_result[0]['total'] if gift_result else 0
+            keys = key_result[0] if key_result else {}
+            gifts = gift_result[0] if gift_result else {}
+            total_keys = keys.get('total', 0)
+            active_keys = keys.get('active', 0)
+            total_requests = keys.get('requests', 0)
+            total_gifts = gifts.get('total', 0)
+            active_gifts = gifts.get('active', 0)
+            total_redemptions = gifts.get('redemptions', 0)
             
-            return {
+            stats = {
                 'total_users': total_users,
                 'total_keys': total_keys,
                 'active_keys': active_keys,
@@ -495,23 +904,33 @@ class Database:
                 'active_gifts': active_gifts,
                 'total_redemptions': total_redemptions
             }
+            self._stats_cache['stats'] = stats
+            return stats
         except Exception as e:
-            print(f"Error getting stats: {e}")
+            logger.error("Error getting stats: %s", e)
             return {}
     
-    def deactivate_expired_keys(self):
+    async def deactivate_expired_keys(self):
         """Deactivate all expired keys (run periodically)"""
         try:
-            all_keys = self.api_keys.find({'is_active': True, 'expiry_date': {'$ne': None}})
-            
-            count = 0
-            for key in all_keys:
-                expiry = datetime.fromisoformat(key['expiry_date'])
-                if datetime.now() > expiry:
-                    self.deactivate_api_key(key['api_key'])
-                    count += 1
-            
-            return count
+            # The server filters and updates every expired key in one call
+            now = datetime.now()
+            result = await self.api_keys.update_many(
+                {'is_active': True, 'expiry_date': {'$ne': None, '$lte': now}},
+                {'$set': {'is_active': False, 'updated_at': now.isoformat()}}
+            )
+            return result.modified_count
         except Exception as e:
-            print(f"Error deactivating expired keys: {e}")
+            logger.error("Error deactivating expired keys: %s", e)
             return 0
+
+
+# Shared instance - one connection pool per process
+_database = None
+
+def get_database() -> Database:
+    """Get or create the shared Database instance"""
+    global _database
+    if _database is None:
+        _database = Database()
+    return _database
@@ -0,0 +1,19 @@
+"""
+Gunicorn config for the Quart apps (api_gateway, advanced_ai_backend)
+Run: gunicorn -c gunicorn_conf.py api_gateway:app
+"""
+
+import os
+import multiprocessing
+
+bind = f"0.0.0.0:{os.getenv('PORT', '5000')}"
+
+# One event loop per worker process - each multiplexes hundreds of
+# in-flight upstream calls, so workers only need to cover the CPUs
+workers = int(os.getenv('WEB_CONCURRENCY', multiprocessing.cpu_count()))
+worker_class = 'uvicorn.workers.UvicornWorker'
+
+# Upstream AI calls can take up to 60s
+timeout = 90
+graceful_timeout = 30
+keepalive = 5
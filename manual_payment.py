@@ -4,6 +4,7 @@ import os
 import logging
 from datetime import datetime
 from typing import Dict, Optional
+from database import get_database
 
 logger = logging.getLogger(__name__)
 
@@ -19,14 +20,64 @@ class ManualPaymentHandler:
         self.upi_id = os.getenv('UPI_ID', 'Aman4380@kphdfc')
         self.admin_username = os.getenv('ADMIN_USERNAME', '@Anonononononon')
         
-        # Track pending payments
-        self.pending_payments = {}
+        # Instructions and UPI link with the fixed details filled in once -
+        # only reference, plan and amount change per request
+        self._instructions_tmpl = f"""
+┏━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━┓
+┃  💳 *PAYMENT INSTRUCTIONS*  ┃
+┗━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━┛
+
+🏷️ *Plan:* {{plan}}
+💵 *Amount:* ₹{{amount}}
+🎯 *Reference:* `{{reference}}`
+
+━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
+
+📱 *UPI PAYMENT METHOD*
+
+🔹 Open PhonePe/GPay/Paytm
+🔹 Scan QR or pay to UPI ID
+
+*UPI ID:* `{self.upi_id}`
+
+✅ Amount: ₹{{amount}}
+✅ Add Note: `{{reference}}`
+
+━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
+
+⚠️ *IMPORTANT STEPS:*
+
+1️⃣ Pay ₹{{amount}} to `{self.upi_id}`
+2️⃣ Add reference: `{{reference}}`
+3️⃣ Take payment screenshot
+4️⃣ Send screenshot to admin
+
+━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
+
+💬 *Contact Admin:*
+{self.admin_username}
+
+Message format:
+"*Payment Done*
+Reference: `{{reference}}`
+Amount: ₹{{amount}}
++ Screenshot"
+
+⏱️ API Key will be activated in *5-10 minutes*
+
+✨ *Thank you for your purchase!*
+        """
+        self._upi_prefix = f"upi://pay?pa={self.upi_id}&pn=Aman"
+        
+        # Payment requests live in the payments collection, so they
+        # survive restarts (Database.ensure_indexes sets up its indexes)
+        self.db = get_database()
         
         logger.info("✅ Manual payment system initialized")
         logger.info(f"💳 UPI ID: {self.upi_id}")
         logger.info(f"👤 Admin: {self.admin_username}")
     
-    def create_payment_request(self, 
+    async def create_payment_request(self, 
                               user_id: int,
                               username: str,
                               plan: str,
@@ -48,16 +99,18 @@ class ManualPaymentHandler:
         reference = f"USER_{user_id}_{plan.upper()}"
         timestamp = datetime.now()
         
-        # Store pending payment
-        self.pending_payments[reference] = {
+        # Store pending payment (replaces an earlier request for the same plan)
+        saved = await self.db.save_payment({
             'user_id': user_id,
             'username': username,
             'plan': plan,
             'amount': amount,
             'reference': reference,
             'status': 'pending',
-            'created_at': timestamp.isoformat()
-        }
+            'created_at': timestamp
+        })
+        if not saved:
+            return {'success': False, 'error': 'Could not save payment request'}
         
         return {
             'success': True,
@@ -73,54 +126,7 @@ class ManualPaymentHandler:
         """
         Generate formatted payment instructions with better UI
         """
-        
-        instructions = f"""
-┏━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━┓
-┃  💳 *PAYMENT INSTRUCTIONS*  ┃
-┗━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━┛
-
-🏷️ *Plan:* {plan.upper()}
-💵 *Amount:* ₹{amount}
-🎯 *Reference:* `{reference}`
-
-━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
-
-📱 *UPI PAYMENT METHOD*
-
-🔹 Open PhonePe/GPay/Paytm
-🔹 Scan QR or pay to UPI ID
-
-*UPI ID:* `{self.upi_id}`
-
-✅ Amount: ₹{amount}
-✅ Add Note: `{reference}`
-
-━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
-
-⚠️ *IMPORTANT STEPS:*
-
-1️⃣ Pay ₹{amount} to `{self.upi_id}`
-2️⃣ Add reference: `{reference}`
-3️⃣ Take payment screenshot
-4️⃣ Send screenshot to admin
-
-━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
-
-💬 *Contact Admin:*
-{self.admin_username}
-
-Message format:
-"*Payment Done*
-Reference: `{reference}`
-Amount: ₹{amount}
-+ Screenshot"
-
-⏱️ API Key will be activated in *5-10 minutes*
-
-✨ *Thank you for your purchase!*
-        """
-        
-        return instructions
+        return self._instructions_tmpl.format(reference=reference, plan=plan.upper(), amount=amount)
     
     def get_payment_qr_text(self, amount: int, reference: str) -> str:
         """
@@ -128,45 +134,32 @@ Amount: ₹{amount}
         """
         
         # UPI payment string format
-        upi_string = f"upi://pay?pa={self.upi_id}&pn=Aman&am={amount}&tn={reference}"
-        
-        return upi_string
+        return f"{self._upi_prefix}&am={amount}&tn={reference}"
     
-    def mark_payment_verified(self, reference: str) -> bool:
+    async def mark_payment_verified(self, reference: str) -> bool:
         """
         Admin marks payment as verified
         """
-        
-        if reference in self.pending_payments:
-            self.pending_payments[reference]['status'] = 'verified'
-            self.pending_payments[reference]['verified_at'] = datetime.now().isoformat()
-            return True
-        return False
+        return await self.db.mark_payment_verified(reference)
     
-    def get_pending_payment(self, reference: str) -> Optional[Dict]:
+    async def get_pending_payment(self, reference: str) -> Optional[Dict]:
         """
         Get pending payment details
         """
-        return self.pending_payments.get(reference)
+        return await self.db.get_payment(reference)
     
-    def get_all_pending_payments(self) -> list:
+    async def get_all_pending_payments(self) -> list:
         """
         Get all pending payments (for admin)
         """
-        return [
-            payment for payment in self.pending_payments.values()
-            if payment['status'] == 'pending'
-        ]
+        return await self.db.get_pending_payments()
     
-    def get_payment_summary(self, user_id: int) -> str:
+    async def get_payment_summary(self, user_id: int) -> str:
         """
         Get payment summary for user with better UI
         """
         
-        user_payments = [
-            p for p in self.pending_payments.values()
-            if p['user_id'] == user_id
-        ]
+        user_payments = await self.db.get_user_payments(user_id)
         
         if not user_payments:
             return """
@@ -195,12 +188,12 @@ Use /buy to purchase a plan!
         
         return summary
     
-    def get_admin_summary(self) -> str:
+    async def get_admin_summary(self) -> str:
         """
         Get pending payments summary for admin with better UI
         """
         
-        pending = self.get_all_pending_payments()
+        pending = await self.get_all_pending_payments()
         
         if not pending:
             return """
@@ -224,7 +217,7 @@ Total: {len(pending)} payment(s)
             summary += f"   🏷️ Plan: *{payment['plan'].upper()}*\n"
             summary += f"   💵 Amount: ₹{payment['amount']}\n"
             summary += f"   🎯 Reference: `{payment['reference']}`\n"
-            summary += f"   📅 Created: {payment['created_at'][:10]}\n\n"
+            summary += f"   📅 Created: {payment['created_at']:%Y-%m-%d}\n\n"
         
         summary += "━━━━━━━━━━━━━━\n"
         summary += "\n✅ To verify: `/verify REFERENCE`\n"
@@ -250,11 +243,4 @@ if __name__ == '__main__':
     # Test
     handler = ManualPaymentHandler()
     
-    result = handler.create_payment_request(
-        user_id=123456,
-        username='testuser',
-        plan='basic',
-        amount=99
-    )
-    
-    print(result['instructions'])
+    print(handler.get_payment_instructions('USER_123456_BASIC', 'basic', 99))
@@ -0,0 +1,20 @@
+"""
+orjson JSON provider for the Quart apps
+Makes jsonify() and request.get_json() use orjson instead of the stdlib json
+"""
+
+import orjson
+from quart.json.provider import DefaultJSONProvider
+
+
+class OrjsonProvider(DefaultJSONProvider):
+    """DefaultJSONProvider with orjson doing the encoding and decoding"""
+    
+    def dumps(self, obj, **kwargs) -> str:
+        # orjson handles datetime/UUID natively; anything else goes through
+        # Quart's default hook (dataclasses, Decimal, ...). Non-str keys are
+        # stringified like the stdlib encoder does instead of raising.
+        return orjson.dumps(obj, default=self.default, option=orjson.OPT_NON_STR_KEYS).decode()
+    
+    def loads(self, s, **kwargs):
+        return orjson.loads(s)
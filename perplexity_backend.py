@@ -6,10 +6,13 @@ Separate module for Perplexity integration - Easy to enable/disable
 import os
 import json
 import time
-import requests
+import logging
+import httpx
 from datetime import datetime
 from typing import Optional, Dict, List, Any
 
+logger = logging.getLogger(__name__)
+
 class PerplexityBackend:
     def __init__(self, api_key: str = None):
         """
@@ -19,7 +22,7 @@ class PerplexityBackend:
             api_key: Perplexity API key (default from env PERPLEXITY_API_KEY)
         """
         # Load from environment if not provided
-        self.api_key = api_key or os.environ.get('PERPLEXITY_API_KEY') or os.getenv('PERPLEXITY_API_KEY')
+        self.api_key = api_key or os.getenv('PERPLEXITY_API_KEY')
         
         # Clean the key (remove spaces/newlines)
         if self.api_key:
@@ -27,6 +30,14 @@ class PerplexityBackend:
         
         self.api_url = 'https://api.perplexity.ai/chat/completions'
         
+        # Async, pooled client - a blocking call here would stall the
+        # event loop (and the router's hedging/cancellation with it)
+        self._http = httpx.AsyncClient(
+            http2=True,
+            limits=httpx.Limits(max_connections=100, max_keepalive_connections=20, keepalive_expiry=60),
+            timeout=httpx.Timeout(30.0, connect=10.0)
+        )
+        
         # Available models
         self.models = {
             'sonar': 'llama-3.1-sonar-small-128k-online',  # Fast, online search
@@ -142,11 +153,10 @@ class PerplexityBackend:
                 'stream': False
             }
             
-            response = requests.post(
+            response = await self._http.post(
                 self.api_url,
                 headers=headers,
-                json=payload,
-                timeout=30
+                json=payload
             )
             
             if response.status_code != 200:
@@ -157,10 +167,11 @@ class PerplexityBackend:
                 except:
                     pass
                 
-                print(f"❌ Perplexity API error: {error_msg}")
+                logger.warning("❌ Perplexity API error: %s", error_msg)
                 return {
                     'success': False,
                     'error': error_msg,
+                    'status': response.status_code,
                     'fallback_needed': True
                 }
             
@@ -181,7 +192,7 @@ class PerplexityBackend:
             if include_context and user_id:
                 self._update_conversation(user_id, question, assistant_message)
             
-            print(f"✅ Perplexity response: {len(assistant_message)} chars, {latency:.2f}s")
+            logger.debug("✅ Perplexity response: %d chars, %.2fs", len(assistant_message), latency)
             
             return {
                 'success': True,
@@ -194,15 +205,15 @@ class PerplexityBackend:
                 'timestamp': datetime.now().isoformat()
             }
             
-        except requests.exceptions.Timeout:
-            print("❌ Perplexity: Request timeout")
+        except httpx.TimeoutException:
+            logger.warning("❌ Perplexity: Request timeout")
             return {
                 'success': False,
                 'error': 'Request timeout',
                 'fallback_needed': True
             }
         except Exception as e:
-            print(f"❌ Perplexity error: {e}")
+            logger.exception("❌ Perplexity error")
             return {
                 'success': False,
                 'error': str(e),
@@ -258,6 +269,10 @@ class PerplexityBackend:
         if len(self.conversations[user_id]) > self.max_history:
             self.conversations[user_id] = self.conversations[user_id][-self.max_history:]
     
+    async def close(self):
+        """Close pooled connections"""
+        await self._http.aclose()
+    
     def clear_conversation(self, user_id: str):
         """Clear conversation history"""
         if user_id in self.conversations:
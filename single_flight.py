@@ -0,0 +1,43 @@
+"""
+Single-flight helper
+Concurrent identical requests share one upstream call instead of each making their own
+"""
+
+import asyncio
+
+
+async def single_flight(inflight: dict, key, call):
+    """Await call() once per key; callers arriving while it runs share its result.
+
+    inflight maps keys to the futures of calls in progress (one dict per
+    call site). The shared result object is returned to every caller, so
+    copy it before changing it. An exception from call() reaches all of
+    them. If the caller making the call is cancelled (its client went
+    away), the others don't inherit the cancellation: they look again,
+    and the first one through makes the call itself.
+    """
+    while True:
+        future = inflight.get(key)
+        if future is None:
+            break
+        try:
+            return await asyncio.shield(future)
+        except asyncio.CancelledError:
+            if not future.cancelled():
+                raise  # This caller itself was cancelled
+
+    future = asyncio.get_running_loop().create_future()
+    inflight[key] = future
+    try:
+        result = await call()
+        future.set_result(result)
+        return result
+    except asyncio.CancelledError:
+        future.cancel()
+        raise
+    except Exception as e:
+        future.set_exception(e)
+        future.exception()  # Mark retrieved so an unawaited error isn't logged
+        raise
+    finally:
+        inflight.pop(key, None)
@@ -6,7 +6,7 @@ from threading import Thread
 from http.server import HTTPServer, BaseHTTPRequestHandler
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
 from telegram.ext import Application, CommandHandler, CallbackQueryHandler, ContextTypes, MessageHandler, filters
-from database import Database
+from database import get_database
 from config import Config
 
 # Import AI Router, Notification Manager, Manual Payment, and System Monitor
@@ -44,7 +44,11 @@ except ImportError:
 logging.basicConfig(format='%(asctime)s - %(name)s - %(levelname)s - %(message)s', level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-db = Database()
+db = get_database()
+
+# The bot's event loop - set on startup. The health server runs in its own
+# thread and hands DB queries to this loop.
+bot_loop = None
 
 # Initialize AI Router
 if AI_ROUTER_AVAILABLE:
@@ -108,7 +112,10 @@ class HealthCheckHandler(BaseHTTPRequestHandler):
             self.send_header('Content-type', 'text/html')
             self.end_headers()
             
-            stats = db.get_stats()
+            if bot_loop:
+                stats = asyncio.run_coroutine_threadsafe(db.get_stats(), bot_loop).result(timeout=5)
+            else:
+                stats = {}
             status_html = f"""
             <html>
             <head><title>Bot Status</title></head>
@@ -194,7 +201,7 @@ PLANS = {
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     try:
         user = update.effective_user
-        is_new = db.register_user(user.id, user.username or user.first_name)
+        is_new = await db.register_user(user.id, user.username or user.first_name)
         
         # Notify about new user
         if system_monitor and is_new:
@@ -238,7 +245,7 @@ async def select_plan(update: Update, context: ContextTypes.DEFAULT_TYPE):
         user_id = query.from_user.id
         username = query.from_user.username or query.from_user.first_name
         
-        has_plan = db.has_active_plan(user_id, plan)
+        has_plan = await db.has_active_plan(user_id, plan)
         if has_plan:
             await query.edit_message_text(
                 f"Already Active!\n\nYou already have an active {plan.upper()} plan.\n\nUse /myapi to view your keys."
@@ -248,7 +255,7 @@ async def select_plan(update: Update, context: ContextTypes.DEFAULT_TYPE):
         if plan == 'free':
             await query.edit_message_text("Generating your free API key...\n\nPlease wait.")
             
-            api_key = db.create_api_key(user_id, username, plan, expiry_days=DEFAULT_FREE_EXPIRY_DAYS)
+            api_key = await db.create_api_key(user_id, username, plan, expiry_days=DEFAULT_FREE_EXPIRY_DAYS)
             
             if api_key:
                 success_message = f"""API KEY GENERATED
@@ -285,7 +292,7 @@ Use /myapi to view keys!
                 await query.edit_message_text("Error!\n\nFailed to generate API key.")
         else:
             if PAYMENT_AVAILABLE:
-                payment_result = payment_handler.create_payment_request(
+                payment_result = await payment_handler.create_payment_request(
                     user_id=user_id,
                     username=username,
                     plan=plan,
@@ -353,7 +360,7 @@ async def payment_done_handler(update: Update, context: ContextTypes.DEFAULT_TYP
             await query.edit_message_text("Payment system unavailable!")
             return
         
-        payment = payment_handler.get_pending_payment(reference)
+        payment = await payment_handler.get_pending_payment(reference)
         
         if not payment:
             await query.edit_message_text("Payment not found!")
@@ -452,7 +459,7 @@ async def verify_from_button(update: Update, context: ContextTypes.DEFAULT_TYPE)
             await query.answer("Payment system unavailable!", show_alert=True)
             return
         
-        payment = payment_handler.get_pending_payment(reference)
+        payment = await payment_handler.get_pending_payment(reference)
         
         if not payment:
             await query.answer("Payment not found!", show_alert=True)
@@ -462,7 +469,7 @@ async def verify_from_button(update: Update, context: ContextTypes.DEFAULT_TYPE)
             await query.answer("Already verified!", show_alert=True)
             return
         
-        api_key = db.create_api_key(
+        api_key = await db.create_api_key(
             telegram_id=payment['user_id'],
             username=payment['username'],
             plan=payment['plan'],
@@ -471,7 +478,7 @@ async def verify_from_button(update: Update, context: ContextTypes.DEFAULT_TYPE)
         )
         
         if api_key:
-            payment_handler.mark_payment_verified(reference)
+            await payment_handler.mark_payment_verified(reference)
             
             if system_monitor:
                 try:
@@ -554,7 +561,7 @@ async def admin_pending_button(update: Update, context: ContextTypes.DEFAULT_TYP
             await query.answer("Payment system unavailable!", show_alert=True)
             return
         
-        summary = payment_handler.get_admin_summary()
+        summary = await payment_handler.get_admin_summary()
         await query.edit_message_text(summary)
     except Exception as e:
         logger.error(f"Error in admin_pending_button: {e}")
@@ -571,7 +578,7 @@ async def my_api_key(update: Update, context: ContextTypes.DEFAULT_TYPE):
             user_id = update.effective_user.id
             edit_message = False
         
-        keys = db.get_active_api_keys(user_id)
+        keys = await db.get_active_api_keys(user_id)
         
         if not keys:
             message = f"""YOUR API KEYS
@@ -596,8 +603,7 @@ You have {len(keys)} active key(s):
                 expiry_text = "No expiry"
                 if key.get('expiry_date'):
                     try:
-                        expiry = datetime.fromisoformat(key['expiry_date'])
-                        days_left = (expiry - datetime.now()).days
+                        days_left = (key['expiry_date'] - datetime.now()).days
                         expiry_text = f"{days_left} days left" if days_left > 0 else "Expired"
                     except:
                         pass
@@ -723,7 +729,7 @@ async def admin_panel(update: Update, context: ContextTypes.DEFAULT_TYPE):
             await update.message.reply_text("Admin only!")
             return
         
-        stats = db.get_stats()
+        stats = await db.get_stats()
         
         panel_text = f"""ADMIN PANEL
 
@@ -776,7 +782,7 @@ async def verify_payment(update: Update, context: ContextTypes.DEFAULT_TYPE):
             return
         
         reference = context.args[0]
-        payment = payment_handler.get_pending_payment(reference)
+        payment = await payment_handler.get_pending_payment(reference)
         
         if not payment:
             await update.message.reply_text(f"Payment not found: {reference}")
@@ -786,7 +792,7 @@ async def verify_payment(update: Update, context: ContextTypes.DEFAULT_TYPE):
             await update.message.reply_text("Already processed!")
             return
         
-        api_key = db.create_api_key(
+        api_key = await db.create_api_key(
             telegram_id=payment['user_id'],
             username=payment['username'],
             plan=payment['plan'],
@@ -795,7 +801,7 @@ async def verify_payment(update: Update, context: ContextTypes.DEFAULT_TYPE):
         )
         
         if api_key:
-            payment_handler.mark_payment_verified(reference)
+            await payment_handler.mark_payment_verified(reference)
             
             if system_monitor:
                 try:
@@ -869,7 +875,7 @@ async def pending_payments(update: Update, context: ContextTypes.DEFAULT_TYPE):
             await update.message.reply_text("Payment system unavailable!")
             return
         
-        summary = payment_handler.get_admin_summary()
+        summary = await payment_handler.get_admin_summary()
         await update.message.reply_text(summary)
     except Exception as e:
         logger.error(f"Error in pending_payments: {e}")
@@ -905,11 +911,7 @@ async def generate_gift_cards(update: Update, context: ContextTypes.DEFAULT_TYPE
             await update.message.reply_text("Max 50 gift cards at once!")
             return
         
-        codes = []
-        for i in range(count):
-            code = db.create_gift_card(plan=plan, max_uses=1, api_expiry_days=days, created_by=ADMIN_ID)
-            if code:
-                codes.append(code)
+        codes = await db.create_gift_cards(count, plan=plan, max_uses=1, api_expiry_days=days, created_by=ADMIN_ID)
         
         if codes:
             if system_monitor:
@@ -938,6 +940,9 @@ Users can redeem with:
         logger.error(f"Error in generate_gift_cards: {e}")
         await update.message.reply_text(f"Error generating gift cards: {str(e)}")
 
+# Fields /giftlist reads - leaves out each card's used_by list
+LIST_GIFTS_PROJECTION = {'_id': 0, 'code': 1, 'plan': 1, 'is_active': 1, 'used_count': 1, 'max_uses': 1, 'api_expiry_days': 1}
+
 async def list_gift_cards(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """List all gift cards"""
     try:
@@ -945,30 +950,37 @@ async def list_gift_cards(update: Update, context: ContextTypes.DEFAULT_TYPE):
             await update.message.reply_text("Admin only!")
             return
         
-        gifts = db.get_all_gift_cards()
-        
-        if not gifts:
+        # Count while streaming - only the first 10 active cards are kept
+        total = active = used = 0
+        shown = []
+        async for gift in db.iter_all_gift_cards(LIST_GIFTS_PROJECTION):
+            total += 1
+            if gift.get('used_count', 0) >= gift.get('max_uses', 1):
+                used += 1
+            elif gift.get('is_active'):
+                active += 1
+                if len(shown) < 10:
+                    shown.append(gift)
+        
+        if not total:
             await update.message.reply_text("No gift cards found!")
             return
         
-        active = [g for g in gifts if g.get('is_active') and g.get('used_count', 0) < g.get('max_uses', 1)]
-        used = [g for g in gifts if g.get('used_count', 0) >= g.get('max_uses', 1)]
-        
         message = f"""GIFT CARDS
 
-Total: {len(gifts)}
-Active: {len(active)}
-Used: {len(used)}
+Total: {total}
+Active: {active}
+Used: {used}
 
 Active Cards:
 
 """
         
-        for idx, gift in enumerate(active[:10], 1):
+        for idx, gift in enumerate(shown, 1):
             message += f"{idx}. {gift['code']} - {gift['plan'].upper()} ({gift.get('api_expiry_days', 'N/A')}d)\n"
         
-        if len(active) > 10:
-            message += f"\n... and {len(active) - 10} more\n"
+        if active > 10:
+            message += f"\n... and {active - 10} more\n"
         
         await update.message.reply_text(message)
     except Exception as e:
@@ -989,7 +1001,7 @@ async def delete_gift_card(update: Update, context: ContextTypes.DEFAULT_TYPE):
             return
         
         code = context.args[0]
-        result = db.delete_gift_card(code)
+        result = await db.delete_gift_card(code)
         
         if result:
             await update.message.reply_text(f"Gift card {code} deleted!")
@@ -1012,7 +1024,7 @@ async def redeem_gift_card(update: Update, context: ContextTypes.DEFAULT_TYPE):
             return
         
         code = context.args[0]
-        result = db.redeem_gift_card(code, user_id, username)
+        result = await db.redeem_gift_card(code, user_id, username)
         
         if result['success']:
             api_key = result['api_key']
@@ -1053,6 +1065,10 @@ Start using now!
         await update.message.reply_text(f"Error redeeming gift card: {str(e)}")
 
 # API Management
+
+# Fields /apilist shows for each key
+LIST_KEYS_PROJECTION = {'_id': 0, 'api_key': 1, 'plan': 1, 'expiry_date': 1, 'username': 1}
+
 async def list_all_apis(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """List all API keys"""
     try:
@@ -1060,39 +1076,37 @@ async def list_all_apis(update: Update, context: ContextTypes.DEFAULT_TYPE):
             await update.message.reply_text("Admin only!")
             return
         
-        all_keys = db.get_all_api_keys()
+        total, active_count = await db.count_api_keys()
         
-        if not all_keys:
+        if not total:
             await update.message.reply_text("No API keys found!")
             return
         
-        active = [k for k in all_keys if k.get('is_active')]
-        inactive = [k for k in all_keys if not k.get('is_active')]
+        active = await db.get_api_keys_page(limit=10, active=True, projection=LIST_KEYS_PROJECTION)
         
         message = f"""ALL API KEYS
 
-Total: {len(all_keys)}
-Active: {len(active)}
-Inactive: {len(inactive)}
+Total: {total}
+Active: {active_count}
+Inactive: {total - active_count}
 
 Active Keys (Latest 10):
 
 """
         
-        for idx, key in enumerate(active[:10], 1):
+        for idx, key in enumerate(active, 1):
             plan_emoji = {"free": "F", "basic": "B", "pro": "P"}.get(key.get('plan'), "?")
             expiry = "No expiry"
             if key.get('expiry_date'):
                 try:
-                    exp = datetime.fromisoformat(key['expiry_date'])
-                    days = (exp - datetime.now()).days
+                    days = (key['expiry_date'] - datetime.now()).days
                     expiry = f"{days}d left" if days > 0 else "Expired"
                 except:
                     pass
             message += f"{idx}. {plan_emoji} {key['api_key'][:20]}... (@{key.get('username')}) - {expiry}\n"
         
-        if len(active) > 10:
-            message += f"\n... and {len(active) - 10} more\n"
+        if active_count > 10:
+            message += f"\n... and {active_count - 10} more\n"
         
         await update.message.reply_text(message)
     except Exception as e:
@@ -1130,7 +1144,7 @@ async def create_api_key_admin(update: Update, context: ContextTypes.DEFAULT_TYP
         except:
             username = f"user_{user_id}"
         
-        api_key = db.create_api_key(
+        api_key = await db.create_api_key(
             telegram_id=user_id,
             username=username,
             plan=plan,
@@ -1197,7 +1211,7 @@ async def delete_api_key(update: Update, context: ContextTypes.DEFAULT_TYPE):
             return
         
         api_key = context.args[0]
-        result = db.delete_api_key(api_key)
+        result = await db.delete_api_key(api_key)
         
         if result:
             if system_monitor:
@@ -1220,7 +1234,7 @@ async def get_stats(update: Update, context: ContextTypes.DEFAULT_TYPE):
             await update.message.reply_text("Admin only!")
             return
         
-        stats = db.get_stats()
+        stats = await db.get_stats(fresh=True)
         
         if system_monitor:
             try:
@@ -1244,9 +1258,25 @@ Updated: {datetime.now().strftime('%Y-%m-%d %H:%M:%S IST')}
         logger.error(f"Error in get_stats: {e}")
         await update.message.reply_text(f"Error loading statistics: {str(e)}")
 
+# How often expired keys are switched off in bulk (validate_api_key
+# already rejects them on sight; this keeps is_active and the stats honest)
+EXPIRY_SWEEP_INTERVAL = 3600
+_expiry_sweep_task = None
+
+async def sweep_expired_keys():
+    while True:
+        count = await db.deactivate_expired_keys()
+        if count:
+            logger.info(f"⏰ Deactivated {count} expired API key(s)")
+        await asyncio.sleep(EXPIRY_SWEEP_INTERVAL)
+
 async def on_startup(application: Application):
     """Called when bot starts"""
+    global bot_loop, _expiry_sweep_task
+    bot_loop = asyncio.get_running_loop()
     try:
+        await db.ensure_indexes()
+        _expiry_sweep_task = asyncio.create_task(sweep_expired_keys())
         if system_monitor:
             try:
                 await system_monitor.notify_bot_start(ADMIN_ID, DEFAULT_FREE_EXPIRY_DAYS, UPI_ID)
@@ -1256,6 +1286,12 @@ async def on_startup(application: Application):
     except Exception as e:
         logger.error(f"Error in on_startup: {e}")
 
+async def on_shutdown(application: Application):
+    """Called when bot stops"""
+    if _expiry_sweep_task:
+        _expiry_sweep_task.cancel()
+    await db.close()
+
 def main():
     try:
         health_thread = Thread(target=run_health_server, daemon=True)
@@ -1300,6 +1336,7 @@ def main():
     
     # Startup notification
     application.post_init = on_startup
+    application.post_shutdown = on_shutdown
     
     logger.info("✅ Bot initialized successfully!")
     logger.info("👑 Admin panel: /admin")
@@ -4,7 +4,7 @@ import asyncio
 from datetime import datetime
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
 from telegram.ext import Application, CommandHandler, CallbackQueryHandler, ContextTypes
-from database import Database
+from database import get_database
 from config import Config
 
 # Import AI Router and Notification Manager
@@ -26,7 +26,7 @@ except ImportError:
 logging.basicConfig(format='%(asctime)s - %(name)s - %(levelname)s - %(message)s', level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-db = Database()
+db = get_database()
 
 # Initialize AI Router
 if AI_ROUTER_AVAILABLE:
@@ -64,7 +64,7 @@ async def select_plan(update: Update, context: ContextTypes.DEFAULT_TYPE):
     username = query.from_user.username or query.from_user.first_name
     
     # Check if user already has plan
-    has_plan = db.has_active_plan(user_id, plan)
+    has_plan = await db.has_active_plan(user_id, plan)
     
     if has_plan:
         message = f"""
@@ -84,7 +84,7 @@ Use /myapi to view all your API keys.
     if plan == 'free':
         await query.edit_message_text("⏳ Generating your API key with AI backend...\n\nPlease wait...")
         
-        api_key = db.create_api_key(user_id, username, plan, expiry_days=DEFAULT_FREE_EXPIRY_DAYS)
+        api_key = await db.create_api_key(user_id, username, plan, expiry_days=DEFAULT_FREE_EXPIRY_DAYS)
         
         if not api_key:
             await query.edit_message_text("❌ Error generating API key. Please try again.")